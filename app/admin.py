@@ -9,3 +9,8 @@ admin.site.register(RouteSubmission)
 admin.site.register(Route)
 admin.site.register(RouteStep)
 admin.site.register(StepFare)
+admin.site.register(PlaceConnection)
+admin.site.register(FareEstimate)
+admin.site.register(BundleTombstone)
+admin.site.register(ApprovalJob)
+admin.site.register(IdempotencyKey)
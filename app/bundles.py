@@ -0,0 +1,210 @@
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+
+from .models import BundleTombstone, City, Place, PlaceAlias, Route, RouteStep
+
+# Offline bundles: everything a client needs to search and read routes in one city without
+# the network, as one gzipped JSON document. The version is the latest change to the city
+# (place/route updated_at or tombstone, in microseconds), so a bundle is built once per
+# version and a client holding version V asks for the delta of rows changed since V.
+# Alias writes move their place's updated_at, step/fare/link writes their route's
+# (app/signals.py); rows leaving a city leave a BundleTombstone.
+
+BUNDLE_FORMAT = 1
+
+# positional rows keep the document small; clients read the column names from "fields"
+PLACE_FIELDS = ["id", "canonical_name", "area", "aliases"]
+ROUTE_FIELDS = ["id", "destination", "starting_places", "recommended", "estimated_time", "difficulty", "notes", "steps"]
+STEP_FIELDS = ["order", "mode", "instruction", "drop_name", "landmark", "fare_min", "fare_max", "fare_sample_size"]
+
+# id batches keep IN (...) lists under SQLite's variable limit
+CHUNK_SIZE = 500
+
+
+def _micros(value):
+    return int(value.timestamp() * 1_000_000) if value is not None else 0
+
+
+def bundle_version(city_id):
+    """The city's current bundle version in one query; None if there is no such city."""
+    latest = lambda queryset, field: Subquery(queryset.order_by(f"-{field}").values(field)[:1])
+    row = City.objects.filter(pk=city_id).annotate(
+        places_updated=latest(Place.objects.filter(city_id=OuterRef("pk")), "updated_at"),
+        routes_updated=latest(Route.objects.filter(destination__city_id=OuterRef("pk")), "updated_at"),
+        last_tombstone=latest(BundleTombstone.objects.filter(city_id=OuterRef("pk")), "deleted_at"),
+    ).values_list("places_updated", "routes_updated", "last_tombstone").first()
+    if row is None:
+        return None
+    return max(_micros(value) for value in row)
+
+
+def bury(city_id, kind, object_ids):
+    if city_id is not None and object_ids:
+        BundleTombstone.objects.bulk_create(
+            BundleTombstone(city_id=city_id, kind=kind, object_id=object_id) for object_id in object_ids
+        )
+
+
+def delta_overlap():
+    # rows committed late by a slow transaction can carry an updated_at older than the
+    # version a client already has; deltas reach this far back so they aren't missed
+    return getattr(settings, "BUNDLE_DELTA_OVERLAP", 60) * 1_000_000
+
+
+def _datetime(micros):
+    return datetime.fromtimestamp(micros / 1_000_000, tz=timezone.utc)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _place_rows(places):
+    rows = list(places.order_by("id").values_list("id", "canonical_name", "area"))
+    aliases = defaultdict(list)
+    for chunk in _chunks(row[0] for row in rows):
+        for place_id, name in PlaceAlias.objects.filter(place_id__in=chunk).order_by("id").values_list("place_id", "name"):
+            aliases[place_id].append(name)
+    return [[place_id, name, area, aliases[place_id]] for place_id, name, area in rows]
+
+
+def _route_rows(routes):
+    rows = list(routes.order_by("id").values_list(
+        "id", "destination_id", "recommended", "estimated_time", "difficulty", "notes",
+    ))
+    starts = defaultdict(list)
+    steps = defaultdict(list)
+    for chunk in _chunks(row[0] for row in rows):
+        through = Route.starting_places.through.objects.filter(route_id__in=chunk).order_by("place_id")
+        for route_id, place_id in through.values_list("route_id", "place_id"):
+            starts[route_id].append(place_id)
+        step_rows = RouteStep.objects.filter(route_id__in=chunk).order_by("route_id", "order").values_list(
+            "route_id", "order", "mode", "instruction", "drop_name", "landmark",
+            "fare_estimate__min_amount", "fare_estimate__max_amount", "fare_estimate__sample_size",
+        )
+        for route_id, *step in step_rows:
+            steps[route_id].append(step)
+    return [
+        [route_id, destination_id, starts[route_id], recommended, estimated_time, difficulty, notes, steps[route_id]]
+        for route_id, destination_id, recommended, estimated_time, difficulty, notes in rows
+    ]
+
+
+def build_bundle(city_id, version, since=None):
+    """
+    The gzipped document: the whole city, or with `since` only the places and routes
+    changed after it plus the ids of those deleted. Nothing is newer than the current
+    version, so a delta from it (or from past it) is empty without asking the database.
+    """
+    places = Place.objects.filter(city_id=city_id)
+    routes = Route.objects.filter(destination__city_id=city_id)
+    deleted = {BundleTombstone.PLACE: [], BundleTombstone.ROUTE: []}
+    if since is not None and since >= version:
+        places, routes = places.none(), routes.none()
+    elif since is not None:
+        changed_after = since - delta_overlap()
+        places = places.filter(updated_at__gt=_datetime(changed_after))
+        routes = routes.filter(updated_at__gt=_datetime(changed_after))
+        tombstones = BundleTombstone.objects.filter(city_id=city_id, deleted_at__gt=_datetime(changed_after))
+        for kind, object_id in tombstones.order_by("id").values_list("kind", "object_id"):
+            deleted[kind].append(object_id)
+    document = {
+        "format": BUNDLE_FORMAT,
+        "city": city_id,
+        "version": version,
+        "since": since,
+        "fields": {"places": PLACE_FIELDS, "routes": ROUTE_FIELDS, "steps": STEP_FIELDS},
+        "places": _place_rows(places),
+        "routes": _route_rows(routes),
+        "deleted": {"places": deleted[BundleTombstone.PLACE], "routes": deleted[BundleTombstone.ROUTE]},
+    }
+    body = json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode()
+    # mtime=0: the same rows always give the same bytes
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def _bundle_name(city_id, version, since):
+    return f"{city_id}-{'full' if since is None else since}-{version}.json.gz"
+
+
+def _issued_key(city_id):
+    return f"bundle:issued:{city_id}"
+
+
+def issued_versions():
+    return getattr(settings, "BUNDLE_DELTA_VERSIONS", 20)
+
+
+def delta_base(city_id, version, since):
+    """
+    The `since` a bundle request is answered from: deltas are only built and stored for
+    the city's last issued_versions() versions this server handed out, so the number of
+    stored bundles stays bounded whatever clients send. An up-to-date client keeps its
+    version (an empty delta); anything else gets the full snapshot (None).
+    """
+    if since is None or since >= version:
+        return since
+    return since if since in (cache.get(_issued_key(city_id)) or ()) else None
+
+
+def _issue(city_id, version):
+    issued = cache.get(_issued_key(city_id)) or []
+    if version not in issued:
+        cache.set(_issued_key(city_id), [*issued, version][-issued_versions():], getattr(settings, "BUNDLE_TIMEOUT", 86400))
+
+
+def get_bundle(city_id, version, since=None):
+    """
+    The bundle bytes for this version, built at most once: from BUNDLE_DIR on disk when
+    that is set (files for the city's older versions are removed as new ones land),
+    otherwise from the cache. Pass `since` through delta_base() first. Empty deltas
+    (since >= version) cost nothing to build and are not stored.
+    """
+    _issue(city_id, version)
+    if since is not None and since >= version:
+        return build_bundle(city_id, version, since)
+    name = _bundle_name(city_id, version, since)
+    directory = getattr(settings, "BUNDLE_DIR", None)
+    if not directory:
+        key = f"bundle:{name}"
+        data = cache.get(key)
+        if data is None:
+            data = build_bundle(city_id, version, since)
+            cache.set(key, data, getattr(settings, "BUNDLE_TIMEOUT", 86400))
+        return data
+
+    path = os.path.join(directory, name)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    data = build_bundle(city_id, version, since)
+    os.makedirs(directory, exist_ok=True)
+    # write then rename so concurrent readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
+    _prune(directory, city_id, version)
+    return data
+
+
+def _prune(directory, city_id, version):
+    """Drop the city's snapshots and deltas built for older versions."""
+    prefix, current = f"{city_id}-", f"-{version}.json.gz"
+    for entry in os.listdir(directory):
+        if entry.startswith(prefix) and entry.endswith(".json.gz") and not entry.endswith(current):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,47 @@
+import time
+from threading import RLock
+
+from django.conf import settings
+
+from .models import City
+from .names import normalize_name
+
+CITY_MAP_TTL = 300
+
+_lock = RLock()
+_city_map = None
+_loaded_at = 0
+
+
+def _load():
+    global _city_map, _loaded_at
+    city_map = {}
+    for pk, name in City.objects.filter(is_active=True).values_list("id", "name"):
+        city_map[normalize_name(name)] = pk
+        city_map[str(pk)] = pk
+    with _lock:
+        _city_map = city_map
+        _loaded_at = time.monotonic()
+    return city_map
+
+
+def get_city_id(value=None):
+    """
+    Resolve a city name ("Abuja, NG", "abuja ng") or id to the id of an active City.
+    Falls back to settings.DEFAULT_CITY when no value is given; returns None for unknown
+    or inactive cities. The name/id map is cached per worker and refreshed on City
+    writes (signals) or every CITY_MAP_TTL seconds for writes made by other workers.
+    """
+    if value is None or not str(value).strip():
+        value = getattr(settings, "DEFAULT_CITY", "Abuja, NG")
+    city_map = _city_map
+    if city_map is None or time.monotonic() - _loaded_at > CITY_MAP_TTL:
+        city_map = _load()
+    value = str(value).strip()
+    return city_map.get(value) if value.isdigit() else city_map.get(normalize_name(value))
+
+
+def drop_city_map():
+    global _city_map
+    with _lock:
+        _city_map = None
@@ -0,0 +1,169 @@
+import math
+import struct
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import FareEstimate, RouteStep
+
+# an estimate needs at least this many reports
+MIN_FARE_SAMPLES = 3
+
+
+class FareSketch:
+    """
+    Decayed quantile sketch of one step's fares: a sparse histogram over log-spaced
+    buckets (each BUCKET_RATIO wide, so ~4% relative error) holding the total weight of
+    the reports that fell into it and their weighted sum of amounts. A quantile reads
+    as the weighted mean of its bucket, so a bucket of one amount gives it back exactly.
+
+    Older reports count for less, halving every `half_life` seconds. The decay is applied
+    forward: a report at time t weighs 2 ** ((t - landmark) / half_life), so stored weights
+    never have to be touched again, quantiles (ratios of weights) come out the same, and a
+    report can be taken back out exactly. add() and remove() are O(1); the landmark only
+    moves (rescaling every bucket) once weights get large, about every 60 half-lives.
+    """
+
+    VERSION = 2
+    BUCKET_RATIO = 1.04
+    MAX_EXPONENT = 60
+    _header = struct.Struct("<BdI")
+    _entry = struct.Struct("<hdd")
+
+    def __init__(self, half_life, landmark=None, count=0, weights=None, sums=None):
+        self.half_life = half_life
+        self.landmark = landmark
+        self.count = count
+        self.weights = weights or {}
+        # bucket -> sum of weight * amount
+        self.sums = sums or {}
+
+    @classmethod
+    def from_bytes(cls, data, half_life):
+        if not data:
+            return cls(half_life)
+        data = bytes(data)
+        version, landmark, count = cls._header.unpack_from(data)
+        weights, sums = {}, {}
+        if version != cls.VERSION:
+            raise ValueError(f"Unknown fare sketch version {version}")
+        for offset in range(cls._header.size, len(data), cls._entry.size):
+            bucket, weights[bucket], sums[bucket] = cls._entry.unpack_from(data, offset)
+        return cls(half_life, landmark, count, weights, sums)
+
+    def to_bytes(self):
+        parts = [self._header.pack(self.VERSION, self.landmark or 0.0, self.count)]
+        parts.extend(self._entry.pack(bucket, weight, self.sums[bucket]) for bucket, weight in sorted(self.weights.items()))
+        return b"".join(parts)
+
+    def _bucket(self, amount):
+        return round(math.log(max(amount, 1)) / math.log(self.BUCKET_RATIO))
+
+    def _weight(self, timestamp):
+        if self.landmark is None:
+            self.landmark = timestamp
+        exponent = (timestamp - self.landmark) / self.half_life
+        if exponent > self.MAX_EXPONENT:
+            # move the landmark forward before weights overflow; relative weights are unchanged
+            scale = 2.0 ** -exponent
+            self.weights = {bucket: weight * scale for bucket, weight in self.weights.items() if weight * scale > 0}
+            self.sums = {bucket: self.sums[bucket] * scale for bucket in self.weights}
+            self.landmark = timestamp
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def add(self, amount, timestamp):
+        bucket = self._bucket(amount)
+        weight = self._weight(timestamp)
+        self.weights[bucket] = self.weights.get(bucket, 0.0) + weight
+        self.sums[bucket] = self.sums.get(bucket, 0.0) + weight * amount
+        self.count += 1
+
+    def remove(self, amount, timestamp):
+        bucket = self._bucket(amount)
+        weight = self._weight(timestamp)
+        remaining = self.weights.get(bucket, 0.0) - weight
+        if remaining > weight * 1e-9:
+            self.weights[bucket] = remaining
+            self.sums[bucket] = self.sums.get(bucket, 0.0) - weight * amount
+        else:
+            self.weights.pop(bucket, None)
+            self.sums.pop(bucket, None)
+        self.count = max(self.count - 1, 0)
+
+    def quantiles(self, percentiles):
+        """Approximate amount at each percentile (0-100), or None if the sketch is empty."""
+        total = sum(self.weights.values())
+        if not total:
+            return None
+        buckets = sorted(self.weights.items())
+        values = []
+        for percentile in percentiles:
+            target = total * percentile / 100
+            running = 0.0
+            for bucket, weight in buckets:
+                running += weight
+                if running >= target:
+                    break
+            # the bucket's weighted mean stays within it, however far rounding drifted the sum
+            low = self.BUCKET_RATIO ** (bucket - 0.5) if bucket > 0 else 0  # bucket 0 also holds free steps
+            high = self.BUCKET_RATIO ** (bucket + 0.5)
+            values.append(round(min(max(self.sums[bucket] / weight, low), high)))
+        return values
+
+
+def fare_half_life():
+    return getattr(settings, "FARE_HALF_LIFE_DAYS", 30) * 86400
+
+
+def fare_percentiles():
+    return getattr(settings, "FARE_ESTIMATE_PERCENTILES", (20, 80))
+
+
+def apply_sketch(estimate, sketch):
+    """Store the sketch on the estimate row along with the band it gives (not saved)."""
+    estimate.sketch = sketch.to_bytes()
+    estimate.sample_size = sketch.count
+    band = sketch.quantiles(fare_percentiles()) if sketch.count >= MIN_FARE_SAMPLES else None
+    estimate.min_amount, estimate.max_amount = band or (None, None)
+    return estimate
+
+
+def record_fare(fare, removed=False):
+    """
+    Fold one added (or deleted) fare into its step's FareEstimate. Runs inside the
+    transaction that writes the fare, so readers never see a fare without its estimate.
+    Returns the step's route id and whether the estimate's band (min_amount, max_amount)
+    moved; most reports only change the sketch.
+    """
+    with transaction.atomic():
+        # serialize concurrent reports for the same step so neither loses the other's update
+        route_id = RouteStep.objects.select_for_update().filter(pk=fare.route_step_id).values_list("route_id", flat=True).first()
+        if route_id is None:
+            return None, False  # the step itself is being deleted
+        estimate = FareEstimate.objects.filter(route_step_id=fare.route_step_id).first()
+        if estimate is None:
+            if removed:
+                return route_id, False
+            estimate = FareEstimate(route_step_id=fare.route_step_id)
+        band = estimate.min_amount, estimate.max_amount
+        sketch = FareSketch.from_bytes(estimate.sketch, fare_half_life())
+        if removed:
+            sketch.remove(fare.amount, fare.created_at.timestamp())
+        else:
+            sketch.add(fare.amount, fare.created_at.timestamp())
+        apply_sketch(estimate, sketch).save()
+    return route_id, (estimate.min_amount, estimate.max_amount) != band
+
+
+def build_fare_estimates(fares):
+    """Replay fares (oldest first) into fresh, unsaved FareEstimate rows, one per step."""
+    sketches = {}
+    half_life = fare_half_life()
+    ordered = fares.order_by("route_step_id", "created_at", "id").values_list("route_step_id", "amount", "created_at")
+    for step_id, amount, created_at in ordered.iterator():
+        sketch = sketches.get(step_id)
+        if sketch is None:
+            sketch = sketches[step_id] = FareSketch(half_life)
+        sketch.add(amount, created_at.timestamp())
+    return [apply_sketch(FareEstimate(route_step_id=step_id), sketch) for step_id, sketch in sketches.items()]
@@ -0,0 +1,146 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ApprovalJob, RouteSubmission
+from .moderation import bulk_approve
+
+# Approvals run out of band: the endpoint records an ApprovalJob row (no locks held) and
+# `manage.py process_approval_jobs` claims queued jobs in batches and approves them through
+# moderation.bulk_approve, so a batch costs the same handful of queries as one approval.
+
+
+class IdempotencyKeyReused(ValueError):
+    pass
+
+
+def _existing_job(submission_id, idempotency_key):
+    """The job this key queued before, else the submission's queued or running job."""
+    if idempotency_key:
+        job = ApprovalJob.objects.filter(idempotency_key=idempotency_key).first()
+        if job is not None:
+            if job.submission_id != submission_id:
+                raise IdempotencyKeyReused("Idempotency-Key was already used for another submission")
+            return job
+    return ApprovalJob.objects.filter(submission_id=submission_id, status__in=ApprovalJob.PENDING).first()
+
+
+def enqueue_approval(submission_id, payload, reviewer=None, idempotency_key=None):
+    """
+    Queue the approval of a submission and return the job. A retry with the same
+    idempotency key, or a second request while the submission is still queued or
+    running, gets the existing job instead of a new one; a retry of a failed job puts
+    it back in the queue while the submission can still be approved. Raises ValueError
+    if the submission can no longer be approved.
+    """
+    job = _existing_job(submission_id, idempotency_key)
+    if job is not None and job.status != ApprovalJob.FAILED:
+        return job
+    status = RouteSubmission.objects.filter(pk=submission_id).values_list("status", flat=True).first()
+    if status != RouteSubmission.SUBMITTED:
+        if job is not None:
+            return job  # failed for good: the retry gets the failure
+        raise ValueError("Submission not in submitted state")
+    try:
+        with transaction.atomic():
+            if job is None:
+                return ApprovalJob.objects.create(
+                    submission_id=submission_id,
+                    reviewer=reviewer,
+                    payload=payload,
+                    idempotency_key=idempotency_key or None,
+                )
+            ApprovalJob.objects.filter(pk=job.pk, status=ApprovalJob.FAILED).update(
+                status=ApprovalJob.QUEUED, error="", attempts=0, started_at=None, finished_at=None,
+            )
+            job.refresh_from_db()
+            return job
+    except IntegrityError:
+        # a concurrent request queued it first
+        job = _existing_job(submission_id, None)
+        if job is None:
+            raise
+        return job
+
+
+def job_timeout():
+    # a running job older than this belonged to a worker that died; it is claimed again
+    return timedelta(seconds=getattr(settings, "APPROVAL_JOB_TIMEOUT", 300))
+
+
+def claim_jobs(batch_size):
+    """Mark up to batch_size of the oldest queued (or abandoned) jobs running and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        # an abandoned run used up an attempt, so a job that keeps killing its worker stops
+        abandoned = ApprovalJob.objects.filter(status=ApprovalJob.RUNNING, started_at__lt=now - job_timeout())
+        abandoned.filter(attempts__gte=max_attempts() - 1).update(
+            status=ApprovalJob.FAILED, attempts=F("attempts") + 1, error="Worker timed out", finished_at=now,
+        )
+        abandoned.update(status=ApprovalJob.QUEUED, attempts=F("attempts") + 1, started_at=None)
+        # concurrent workers skip each other's rows instead of waiting on them
+        claimed = list(
+            ApprovalJob.objects.select_for_update(skip_locked=True)
+            .filter(status=ApprovalJob.QUEUED)
+            .order_by("created_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        ApprovalJob.objects.filter(pk__in=claimed).update(status=ApprovalJob.RUNNING, started_at=now)
+    return list(ApprovalJob.objects.filter(pk__in=claimed).select_related("reviewer").order_by("created_at", "id"))
+
+
+def max_attempts():
+    return getattr(settings, "APPROVAL_JOB_MAX_ATTEMPTS", 5)
+
+
+def run_jobs(jobs):
+    """
+    Approve the claimed jobs, one bulk_approve per reviewer, and record each outcome.
+    A batch that hit a database error (deadlock, lock timeout, lost connection) goes
+    back in the queue until its jobs have had max_attempts() tries; any other error
+    runs the batch again one job at a time, so only the job that raised it fails.
+    """
+    by_reviewer = defaultdict(list)
+    for job in jobs:
+        by_reviewer[job.reviewer_id].append(job)
+    for reviewer_jobs in by_reviewer.values():
+        _run_batch(reviewer_jobs)
+    return jobs
+
+
+def _run_batch(jobs):
+    items = [{**job.payload, "id": job.submission_id} for job in jobs]
+    transient = False
+    try:
+        results = bulk_approve(items, reviewer=jobs[0].reviewer)
+    except OperationalError as error:
+        transient = True
+        results = [{"id": job.submission_id, "error": str(error) or type(error).__name__} for job in jobs]
+    except Exception as error:
+        if len(jobs) > 1:
+            # nothing was approved; one bad payload must not fail the others, so run them one by one
+            for job in jobs:
+                _run_batch([job])
+            return
+        results = [{"id": jobs[0].submission_id, "error": str(error) or type(error).__name__}]
+    now = timezone.now()
+    for job, result in zip(jobs, results):
+        job.attempts += 1
+        job.route_id = result.get("route_id")
+        job.error = result.get("error", "")
+        if transient and job.attempts < max_attempts():
+            job.status, job.started_at, job.finished_at = ApprovalJob.QUEUED, None, None
+        else:
+            job.status = ApprovalJob.FAILED if "error" in result else ApprovalJob.DONE
+            job.finished_at = now
+    ApprovalJob.objects.bulk_update(jobs, ["status", "route", "error", "attempts", "started_at", "finished_at"])
+
+
+def process_jobs(batch_size=50):
+    """Claim and run one batch; returns the jobs processed (empty when the queue is)."""
+    jobs = claim_jobs(batch_size)
+    return run_jobs(jobs) if jobs else []
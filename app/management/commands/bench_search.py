@@ -0,0 +1,45 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import City, Place
+from app.search import IContainsSearchBackend, get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Compare the configured place search backend against the original icontains query."
+
+    def add_arguments(self, parser):
+        parser.add_argument("queries", nargs="*", default=["wu", "market", "garki", "area 1"])
+        parser.add_argument("--city", default="Abuja, NG")
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--backend", help="Dotted path of the backend to benchmark")
+
+    def handle(self, *args, **options):
+        city = City.objects.filter(name__iexact=options["city"]).first()
+        if city is None:
+            raise CommandError(f"Unknown city {options['city']!r}")
+
+        baseline = IContainsSearchBackend()
+        backend = get_search_backend(options["backend"])
+        places = Place.objects.filter(city=city)
+        self.stdout.write(f"{places.count()} places in {city.name}, {options['repeat']} runs per query")
+
+        for query in options["queries"]:
+            base_ms, base_hits = self.time(baseline, places, query, city.id, options["repeat"])
+            new_ms, new_hits = self.time(backend, places, query, city.id, options["repeat"])
+            self.stdout.write(
+                f"{query!r:>16}  icontains {base_ms:8.3f} ms ({base_hits} hits)  "
+                f"{type(backend).__name__} {new_ms:8.3f} ms ({new_hits} hits)"
+            )
+
+    def time(self, backend, queryset, query, city_id, repeat):
+        # one warm-up run so lazily built indexes are not counted
+        hits = len(list(backend.filter(queryset, query, city_id).values_list("id", flat=True)))
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(backend.filter(queryset, query, city_id).values_list("id", flat=True))
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples), hits
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from app.models import Place, Route
+from app.renderers import FastJSONRenderer, orjson
+from app.route_cache import with_route_details
+from app.serializers import PlaceSearchSerializer, RouteSerializer, read_routes, rows_data
+
+
+class Command(BaseCommand):
+    help = "Per-object cost of the ModelSerializer + JSONRenderer path against the .values() readers + FastJSONRenderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--routes", type=int, default=50, help="Routes per run")
+        parser.add_argument("--places", type=int, default=200, help="Places per run")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        route_ids = list(Route.objects.order_by("id").values_list("id", flat=True)[:options["routes"]])
+        place_ids = list(Place.objects.order_by("id").values_list("id", flat=True)[:options["places"]])
+        if not route_ids or not place_ids:
+            raise CommandError("Needs some routes and places in the database")
+        self.stdout.write(
+            f"{len(route_ids)} routes, {len(place_ids)} places, {options['repeat']} runs; "
+            f"orjson {'available' if orjson else 'not installed (stdlib fallback)'}"
+        )
+        repeat = options["repeat"]
+
+        def routes_stock():
+            routes = with_route_details(Route.objects.filter(pk__in=route_ids).order_by("id"))
+            return JSONRenderer().render(RouteSerializer(routes, many=True).data)
+
+        def routes_fast():
+            data = read_routes(route_ids)
+            return FastJSONRenderer().render([data[route_id] for route_id in route_ids])
+
+        def places_stock():
+            places = Place.objects.filter(pk__in=place_ids).order_by("id")
+            return JSONRenderer().render(PlaceSearchSerializer(places, many=True).data)
+
+        def places_fast():
+            fields = PlaceSearchSerializer.Meta.fields
+            rows = Place.objects.filter(pk__in=place_ids).order_by("id").values(*fields)
+            return FastJSONRenderer().render(rows_data(rows, fields))
+
+        for label, stock, fast, count in (
+            ("route", routes_stock, routes_fast, len(route_ids)),
+            ("place", places_stock, places_fast, len(place_ids)),
+        ):
+            if stock() != fast():
+                self.stdout.write(self.style.WARNING(f"{label}: fast path output differs from the serializer"))
+            stock_us = self.time(stock, repeat) / count
+            fast_us = self.time(fast, repeat) / count
+            self.stdout.write(
+                f"{label:>6}  serializer {stock_us:9.1f} us/object  fast path {fast_us:9.1f} us/object  "
+                f"({stock_us / fast_us:.1f}x)"
+            )
+
+    def time(self, func, repeat):
+        func()  # warm-up
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1_000_000)
+        return statistics.median(samples)
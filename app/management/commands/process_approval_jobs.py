@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.jobs import process_jobs
+from app.models import ApprovalJob
+
+
+class Command(BaseCommand):
+    help = "Work through queued submission approvals (ApprovalJob) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Jobs claimed per batch.")
+        parser.add_argument("--sleep", type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty instead of polling.")
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            jobs = process_jobs(options["batch_size"])
+            processed += len(jobs)
+            if jobs:
+                failed = sum(job.status == ApprovalJob.FAILED for job in jobs)
+                retrying = sum(job.status == ApprovalJob.QUEUED for job in jobs)
+                self.stdout.write(f"Processed {len(jobs)} approval jobs ({failed} failed, {retrying} to retry)")
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} approval jobs"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app.fares import build_fare_estimates
+from app.models import FareEstimate, Route, StepFare
+
+
+class Command(BaseCommand):
+    help = "Rebuild every step's fare sketch and estimate by replaying all StepFare reports."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            estimates = build_fare_estimates(StepFare.objects.all())
+            FareEstimate.objects.all().delete()
+            created = FareEstimate.objects.bulk_create(estimates, batch_size=500)
+            # cached route documents and offline bundles carry the old bands
+            Route.objects.update(updated_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(created)} fare estimates"))
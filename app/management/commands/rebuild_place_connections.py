@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from app.models import PlaceConnection, Route
+
+
+class Command(BaseCommand):
+    help = "Rebuild the destination -> starting place adjacency (PlaceConnection) from the routes."
+
+    def handle(self, *args, **options):
+        counts = (
+            Route.starting_places.through.objects
+            .values("route__destination_id", "place_id")
+            .annotate(routes=Count("route_id"))
+        )
+        with transaction.atomic():
+            PlaceConnection.objects.all().delete()
+            created = PlaceConnection.objects.bulk_create(
+                PlaceConnection(
+                    destination_id=row["route__destination_id"],
+                    starting_place_id=row["place_id"],
+                    route_count=row["routes"],
+                )
+                for row in counts
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(created)} place connections"))
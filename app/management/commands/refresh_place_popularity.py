@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from app.models import Place
+
+
+class Command(BaseCommand):
+    help = "Recompute Place.route_count (incoming + outgoing routes) from scratch."
+
+    def handle(self, *args, **options):
+        counts = Place.objects.annotate(
+            incoming=Count("incoming_routes", distinct=True),
+            outgoing=Count("outgoing_routes", distinct=True),
+        ).values_list("id", "route_count", "incoming", "outgoing")
+        changed = 0
+        for pk, current, incoming, outgoing in counts:
+            if current != incoming + outgoing:
+                Place.objects.filter(pk=pk).update(route_count=incoming + outgoing)
+                changed += 1
+        self.stdout.write(self.style.SUCCESS(f"Updated route_count on {changed} places"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the place search index used by the configured PLACE_SEARCH_BACKEND."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", help="Dotted path of a backend to reindex instead of the configured one")
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options["backend"])
+        backend.reindex()
+        self.stdout.write(self.style.SUCCESS(f"Reindexed places with {type(backend).__name__}"))
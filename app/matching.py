@@ -0,0 +1,162 @@
+from collections import Counter, defaultdict
+from threading import RLock
+
+from django.conf import settings
+from django.db.models import Value
+
+from .models import Place, PlaceAlias
+from .names import normalize_name
+from .search_cache import get_generation
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein distance; gives up and returns limit + 1 once it must exceed `limit`."""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def grams(key, n=3):
+    padded = f"^{key}$"
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def _numbers(key):
+    return [token for token in key.split() if token.isdigit()]
+
+
+class PlaceDictionary:
+    """
+    All canonical names and aliases of one city, keyed by normalize_name().
+    Exact keys are a dict lookup. Near misses are gathered from the trigram posting lists
+    and only those candidates are checked with a bounded edit_distance, so a miss costs
+    a few posting-list walks instead of a scan over the city.
+    """
+
+    def __init__(self, city_id):
+        self.city_id = city_id
+        self.generation = None
+        self.names = {}
+        self.postings = defaultdict(list)
+        self._lock = RLock()
+
+    def build(self):
+        canonical = (
+            Place.objects.filter(city_id=self.city_id)
+            .annotate(kind=Value(0))
+            .values_list("kind", "normalized_name", "id")
+        )
+        aliases = (
+            PlaceAlias.objects.filter(city_id=self.city_id)
+            .annotate(kind=Value(1))
+            .values_list("kind", "normalized_name", "place_id")
+        )
+        # one round trip; canonical names sort first so they win over an alias with the same key,
+        # and an alias several places share goes to the oldest of them
+        for _, key, place_id in sorted(canonical.union(aliases, all=True), key=lambda row: (row[0], row[2])):
+            self.add_key(key, place_id)
+        return self
+
+    def add(self, name, place_id):
+        self.add_key(normalize_name(name), place_id)
+
+    def add_key(self, key, place_id):
+        if not key:
+            return
+        with self._lock:
+            if key not in self.names:
+                self.names[key] = place_id
+                for gram in grams(key):
+                    self.postings[gram].append(key)
+
+    def exact(self, name):
+        return self.names.get(normalize_name(name))
+
+    def match(self, name, threshold=None):
+        """Return (place_id, confidence) of the best existing place, or None below the threshold."""
+        if threshold is None:
+            threshold = getattr(settings, "PLACE_MATCH_THRESHOLD", 0.85)
+        key = normalize_name(name)
+        if not key:
+            return None
+        with self._lock:
+            if key in self.names:
+                return self.names[key], 1.0
+
+            # largest distance that can still reach the threshold for a key this long
+            radius = int((1 - threshold) * len(key) / threshold)
+            if radius < 1:
+                return None
+
+            shared = Counter()
+            for gram in grams(key):
+                shared.update(self.postings.get(gram, ()))
+            # k edits destroy at most 3k of the key's trigrams
+            needed = max(1, len(key) - 3 * radius)
+            numbers = _numbers(key)
+
+            best = None
+            for candidate, count in shared.items():
+                if count < needed or abs(len(candidate) - len(key)) > radius:
+                    continue
+                # "phase 1" must never resolve to "phase 2"
+                if _numbers(candidate) != numbers:
+                    continue
+                distance = edit_distance(key, candidate, radius)
+                if distance > radius:
+                    continue
+                score = 1 - distance / max(len(key), len(candidate))
+                if score < threshold:
+                    continue
+                ranked = (score, -self.names[candidate])
+                if best is None or ranked > best[0]:
+                    best = (ranked, self.names[candidate], score)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+
+_dictionaries = {}
+_dictionaries_lock = RLock()
+
+
+def get_place_dictionary(city_id):
+    generation = get_generation(city_id)
+    dictionary = _dictionaries.get(city_id)
+    if dictionary is None or dictionary.generation != generation:
+        with _dictionaries_lock:
+            dictionary = _dictionaries.get(city_id)
+            if dictionary is None or dictionary.generation != generation:
+                dictionary = PlaceDictionary(city_id)
+                dictionary.generation = generation
+                _dictionaries[city_id] = dictionary.build()
+    return dictionary
+
+
+def loaded_dictionary(city_id):
+    return _dictionaries.get(city_id)
+
+
+def drop_place_dictionary(city_id=None):
+    with _dictionaries_lock:
+        if city_id is None:
+            _dictionaries.clear()
+        else:
+            _dictionaries.pop(city_id, None)
+
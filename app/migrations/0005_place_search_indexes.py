@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# Only what doesn't depend on the names: 0007 builds the indexes, search_vector columns and
+# FTS rows on normalized_name once 0006 has added and backfilled it.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+]
+
+# rowid = place.id * 2 for canonical names, alias.id * 2 + 1 for aliases
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS app_place_fts USING fts5("
+    "name, place_id UNINDEXED, city_id UNINDEXED, tokenize='trigram')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TABLE IF EXISTS app_place_fts",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_alter_routestep_mode_alter_routestepsubmission_mode'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            run({"sqlite": SQLITE_REVERSE}),
+        ),
+    ]
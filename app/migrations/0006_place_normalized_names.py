@@ -0,0 +1,132 @@
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of app.names.normalize_name as this migration backfilled with it, so later
+# changes there can't change (or break) what the backfill keys and merges on.
+ROMAN_NUMERALS = {
+    "i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6",
+    "vii": "7", "viii": "8", "ix": "9", "x": "10", "xi": "11", "xii": "12",
+}
+
+ABBREVIATIONS = {
+    "rd": "road",
+    "st": "street",
+    "ave": "avenue",
+    "jn": "junction",
+    "jnc": "junction",
+    "jct": "junction",
+    "mkt": "market",
+}
+
+
+def normalize_name(name):
+    tokens = re.findall(r"[^\W_]+", (name or "").casefold())
+    normalized = []
+    for position, token in enumerate(tokens):
+        if position and token in ROMAN_NUMERALS:
+            token = ROMAN_NUMERALS[token]
+        normalized.append(ABBREVIATIONS.get(token, token))
+    return " ".join(normalized)
+
+
+def merge_place(apps, duplicate, keep):
+    """Repoint everything referencing `duplicate` at `keep`, then delete it."""
+    Route = apps.get_model("app", "Route")
+    RouteSubmission = apps.get_model("app", "RouteSubmission")
+    PlaceAlias = apps.get_model("app", "PlaceAlias")
+    through = Route.starting_places.through
+
+    Route.objects.filter(destination_id=duplicate.pk).update(destination_id=keep.pk)
+    RouteSubmission.objects.filter(starting_point_id=duplicate.pk).update(starting_point_id=keep.pk)
+    for link in through.objects.filter(place_id=duplicate.pk):
+        if through.objects.filter(route_id=link.route_id, place_id=keep.pk).exists():
+            link.delete()
+        else:
+            link.place_id = keep.pk
+            link.save(update_fields=["place"])
+    for alias in PlaceAlias.objects.filter(place_id=duplicate.pk):
+        if PlaceAlias.objects.filter(place_id=keep.pk, name=alias.name).exists():
+            alias.delete()
+        else:
+            alias.place_id = keep.pk
+            alias.save(update_fields=["place"])
+    if duplicate.canonical_name != keep.canonical_name and not PlaceAlias.objects.filter(
+        place_id=keep.pk, name=duplicate.canonical_name
+    ).exists():
+        # keep the merged spelling searchable
+        PlaceAlias.objects.create(place_id=keep.pk, name=duplicate.canonical_name, city_id=keep.city_id)
+    duplicate.delete()
+
+
+def backfill(apps, schema_editor):
+    Place = apps.get_model("app", "Place")
+    PlaceAlias = apps.get_model("app", "PlaceAlias")
+
+    # places that only differ by case/spelling are merged into the oldest row
+    kept = {}
+    for place in Place.objects.order_by("id"):
+        place.normalized_name = normalize_name(place.canonical_name)
+        key = (place.city_id, place.normalized_name)
+        if key in kept:
+            merge_place(apps, place, kept[key])
+            continue
+        kept[key] = place
+        place.save(update_fields=["normalized_name"])
+
+    # aliases stay unique per place; only spellings of one alias of the same place collapse
+    seen = set()
+    for alias in PlaceAlias.objects.select_related("place").order_by("id"):
+        alias.normalized_name = normalize_name(alias.name)
+        alias.city_id = alias.place.city_id
+        key = (alias.place_id, alias.normalized_name)
+        if key in seen:
+            alias.delete()
+            continue
+        seen.add(key)
+        alias.save(update_fields=["normalized_name", "city"])
+
+
+def split_merged_places(apps, schema_editor):
+    """
+    Undo the merges as far as the data allows: every merged spelling kept as an alias
+    (an alias normalizing to its own place's name) becomes a Place of its own again.
+    Routes and submissions stay on the place they were merged into, and alias spellings
+    collapsed within one place are not restored.
+    """
+    Place = apps.get_model("app", "Place")
+    PlaceAlias = apps.get_model("app", "PlaceAlias")
+    for alias in PlaceAlias.objects.select_related("place").order_by("id"):
+        place = alias.place
+        if alias.normalized_name and alias.normalized_name == place.normalized_name:
+            Place.objects.create(city_id=place.city_id, canonical_name=alias.name, area=place.area)
+            alias.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_place_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=200),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='placealias',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=200),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='placealias',
+            name='city',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='place_aliases', to='app.city'),
+        ),
+        migrations.RunPython(backfill, split_merged_places),
+    ]
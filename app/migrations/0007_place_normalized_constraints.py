@@ -0,0 +1,112 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# search indexes the normalized names (0005 only set up pg_trgm and the FTS table)
+POSTGRES_FORWARD = [
+    "CREATE INDEX IF NOT EXISTS app_place_normalized_trgm ON app_place USING gin (normalized_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS app_placealias_normalized_trgm ON app_placealias USING gin (normalized_name gin_trgm_ops)",
+    "ALTER TABLE app_place ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', normalized_name)) STORED",
+    "ALTER TABLE app_placealias ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', normalized_name)) STORED",
+    "CREATE INDEX IF NOT EXISTS app_place_search_vector ON app_place USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS app_placealias_search_vector ON app_placealias USING gin (search_vector)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS app_placealias_search_vector",
+    "DROP INDEX IF EXISTS app_place_search_vector",
+    "ALTER TABLE app_placealias DROP COLUMN IF EXISTS search_vector",
+    "ALTER TABLE app_place DROP COLUMN IF EXISTS search_vector",
+    "DROP INDEX IF EXISTS app_placealias_normalized_trgm",
+    "DROP INDEX IF EXISTS app_place_normalized_trgm",
+]
+
+SQLITE_TRIGGERS = [
+    "app_place_fts_ai", "app_place_fts_au", "app_place_fts_ad",
+    "app_placealias_fts_ai", "app_placealias_fts_au", "app_placealias_fts_ad",
+]
+
+# created after the table rebuilds above, which SQLite refuses while triggers reference the tables
+SQLITE_FORWARD = [
+    "INSERT INTO app_place_fts(rowid, name, place_id, city_id) "
+    "SELECT id * 2, normalized_name, id, city_id FROM app_place",
+    "INSERT INTO app_place_fts(rowid, name, place_id, city_id) "
+    "SELECT id * 2 + 1, normalized_name, place_id, city_id FROM app_placealias",
+    """CREATE TRIGGER app_place_fts_ai AFTER INSERT ON app_place BEGIN
+        INSERT INTO app_place_fts(rowid, name, place_id, city_id) VALUES (new.id * 2, new.normalized_name, new.id, new.city_id);
+    END""",
+    """CREATE TRIGGER app_place_fts_au AFTER UPDATE ON app_place BEGIN
+        UPDATE app_place_fts SET name = new.normalized_name, city_id = new.city_id WHERE rowid = new.id * 2;
+    END""",
+    """CREATE TRIGGER app_place_fts_ad AFTER DELETE ON app_place BEGIN
+        DELETE FROM app_place_fts WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER app_placealias_fts_ai AFTER INSERT ON app_placealias BEGIN
+        INSERT INTO app_place_fts(rowid, name, place_id, city_id) VALUES (new.id * 2 + 1, new.normalized_name, new.place_id, new.city_id);
+    END""",
+    """CREATE TRIGGER app_placealias_fts_au AFTER UPDATE ON app_placealias BEGIN
+        UPDATE app_place_fts SET name = new.normalized_name, place_id = new.place_id, city_id = new.city_id
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER app_placealias_fts_ad AFTER DELETE ON app_placealias BEGIN
+        DELETE FROM app_place_fts WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+SQLITE_REVERSE = [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + ["DELETE FROM app_place_fts"]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_place_normalized_names'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='placealias',
+            name='city',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='place_aliases', to='app.city'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='place',
+            unique_together=set(),
+        ),
+        migrations.RemoveIndex(
+            model_name='place',
+            name='app_place_city_id_10dc09_idx',
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['city', 'normalized_name'], name='app_place_city_normalized_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='place',
+            constraint=models.UniqueConstraint(fields=('city', 'normalized_name'), name='unique_place_normalized_name'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='placealias',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='placealias',
+            index=models.Index(fields=['city', 'normalized_name'], name='app_alias_city_normalized_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='placealias',
+            constraint=models.UniqueConstraint(fields=('place', 'normalized_name'), name='unique_alias_normalized_name'),
+        ),
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            run({"postgresql": POSTGRES_REVERSE, "sqlite": SQLITE_REVERSE}),
+        ),
+    ]
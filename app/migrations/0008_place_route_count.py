@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    Place = apps.get_model("app", "Place")
+    counts = Place.objects.annotate(
+        incoming=Count("incoming_routes", distinct=True),
+        outgoing=Count("outgoing_routes", distinct=True),
+    ).values_list("id", "incoming", "outgoing")
+    for pk, incoming, outgoing in counts:
+        if incoming or outgoing:
+            Place.objects.filter(pk=pk).update(route_count=incoming + outgoing)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_place_normalized_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='route_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
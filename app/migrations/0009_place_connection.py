@@ -0,0 +1,47 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill(apps, schema_editor):
+    Route = apps.get_model("app", "Route")
+    PlaceConnection = apps.get_model("app", "PlaceConnection")
+    counts = (
+        Route.starting_places.through.objects
+        .values("route__destination_id", "place_id")
+        .annotate(routes=Count("route_id"))
+    )
+    PlaceConnection.objects.bulk_create(
+        PlaceConnection(
+            destination_id=row["route__destination_id"],
+            starting_place_id=row["place_id"],
+            route_count=row["routes"],
+        )
+        for row in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_place_route_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_count', models.PositiveIntegerField(default=0)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbound_connections', to='app.place')),
+                ('starting_place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbound_connections', to='app.place')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['destination', '-route_count'], name='app_connection_dest_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('destination', 'starting_place'), name='unique_place_connection')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_place_connection'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='routesubmission',
+            index=models.Index(fields=['-created_at', '-id'], name='app_submission_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stepfare',
+            index=models.Index(fields=['route_step', '-created_at', '-id'], name='app_stepfare_step_created_idx'),
+        ),
+    ]
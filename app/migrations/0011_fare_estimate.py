@@ -0,0 +1,57 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:34
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def backfill(apps, schema_editor):
+    StepFare = apps.get_model("app", "StepFare")
+    FareEstimate = apps.get_model("app", "FareEstimate")
+    latest = (
+        StepFare.objects.annotate(row=Window(
+            RowNumber(),
+            partition_by=F("route_step_id"),
+            order_by=[F("created_at").desc(), F("id").desc()],
+        ))
+        .filter(row__lte=30)
+        .values_list("route_step_id", "amount")
+    )
+    amounts = defaultdict(list)
+    for step_id, amount in latest:
+        amounts[step_id].append(amount)
+    FareEstimate.objects.bulk_create(
+        FareEstimate(
+            route_step_id=step_id,
+            min_amount=sorted(values)[int(len(values) * 0.2)],
+            max_amount=sorted(values)[int(len(values) * 0.8)],
+            sample_size=len(values),
+        )
+        for step_id, values in amounts.items()
+        if len(values) >= 3
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FareEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_amount', models.PositiveIntegerField()),
+                ('max_amount', models.PositiveIntegerField()),
+                ('sample_size', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('route_step', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fare_estimate', to='app.routestep')),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
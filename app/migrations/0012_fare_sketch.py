@@ -0,0 +1,134 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:36
+
+import math
+import struct
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copies of app.fares as this migration wrote it (sketch format version 2), so later
+# changes there can't change what the backfill computes or stores.
+MIN_FARE_SAMPLES = 3
+
+
+def fare_half_life():
+    return getattr(settings, "FARE_HALF_LIFE_DAYS", 30) * 86400
+
+
+def fare_percentiles():
+    return getattr(settings, "FARE_ESTIMATE_PERCENTILES", (20, 80))
+
+
+class FareSketch:
+    VERSION = 2
+    BUCKET_RATIO = 1.04
+    MAX_EXPONENT = 60
+    _header = struct.Struct("<BdI")
+    _entry = struct.Struct("<hdd")
+
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.landmark = None
+        self.count = 0
+        self.weights = {}
+        self.sums = {}
+
+    def to_bytes(self):
+        parts = [self._header.pack(self.VERSION, self.landmark or 0.0, self.count)]
+        parts.extend(self._entry.pack(bucket, weight, self.sums[bucket]) for bucket, weight in sorted(self.weights.items()))
+        return b"".join(parts)
+
+    def _bucket(self, amount):
+        return round(math.log(max(amount, 1)) / math.log(self.BUCKET_RATIO))
+
+    def _weight(self, timestamp):
+        if self.landmark is None:
+            self.landmark = timestamp
+        exponent = (timestamp - self.landmark) / self.half_life
+        if exponent > self.MAX_EXPONENT:
+            scale = 2.0 ** -exponent
+            self.weights = {bucket: weight * scale for bucket, weight in self.weights.items() if weight * scale > 0}
+            self.sums = {bucket: self.sums[bucket] * scale for bucket in self.weights}
+            self.landmark = timestamp
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def add(self, amount, timestamp):
+        bucket = self._bucket(amount)
+        weight = self._weight(timestamp)
+        self.weights[bucket] = self.weights.get(bucket, 0.0) + weight
+        self.sums[bucket] = self.sums.get(bucket, 0.0) + weight * amount
+        self.count += 1
+
+    def quantiles(self, percentiles):
+        total = sum(self.weights.values())
+        if not total:
+            return None
+        buckets = sorted(self.weights.items())
+        values = []
+        for percentile in percentiles:
+            target = total * percentile / 100
+            running = 0.0
+            for bucket, weight in buckets:
+                running += weight
+                if running >= target:
+                    break
+            low = self.BUCKET_RATIO ** (bucket - 0.5) if bucket > 0 else 0
+            high = self.BUCKET_RATIO ** (bucket + 0.5)
+            values.append(round(min(max(self.sums[bucket] / weight, low), high)))
+        return values
+
+
+def backfill(apps, schema_editor):
+    StepFare = apps.get_model("app", "StepFare")
+    FareEstimate = apps.get_model("app", "FareEstimate")
+    sketches = {}
+    fares = StepFare.objects.order_by("route_step_id", "created_at", "id").values_list("route_step_id", "amount", "created_at")
+    for step_id, amount, created_at in fares.iterator():
+        sketch = sketches.setdefault(step_id, FareSketch(fare_half_life()))
+        sketch.add(amount, created_at.timestamp())
+
+    FareEstimate.objects.all().delete()
+    estimates = []
+    for step_id, sketch in sketches.items():
+        band = sketch.quantiles(fare_percentiles()) if sketch.count >= MIN_FARE_SAMPLES else None
+        min_amount, max_amount = band or (None, None)
+        estimates.append(FareEstimate(
+            route_step_id=step_id,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            sample_size=sketch.count,
+            sketch=sketch.to_bytes(),
+        ))
+    FareEstimate.objects.bulk_create(estimates, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_fare_estimate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fareestimate',
+            name='sketch',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AlterField(
+            model_name='fareestimate',
+            name='max_amount',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='fareestimate',
+            name='min_amount',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='fareestimate',
+            name='sample_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
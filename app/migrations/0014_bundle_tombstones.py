@@ -0,0 +1,36 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BundleTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('place', 'Place'), ('route', 'Route')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['city', 'updated_at'], name='app_place_city_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='bundletombstone',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bundle_tombstones', to='app.city'),
+        ),
+        migrations.AddIndex(
+            model_name='bundletombstone',
+            index=models.Index(fields=['city', 'deleted_at'], name='app_tombstone_city_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:49
+
+import hashlib
+import re
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of app.names.normalize_name and route_fingerprint as this migration
+# backfilled with them, so later changes there can't change what it computes.
+ROMAN_NUMERALS = {
+    "i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6",
+    "vii": "7", "viii": "8", "ix": "9", "x": "10", "xi": "11", "xii": "12",
+}
+
+ABBREVIATIONS = {
+    "rd": "road",
+    "st": "street",
+    "ave": "avenue",
+    "jn": "junction",
+    "jnc": "junction",
+    "jct": "junction",
+    "mkt": "market",
+}
+
+
+def normalize_name(name):
+    tokens = re.findall(r"[^\W_]+", (name or "").casefold())
+    normalized = []
+    for position, token in enumerate(tokens):
+        if position and token in ROMAN_NUMERALS:
+            token = ROMAN_NUMERALS[token]
+        normalized.append(ABBREVIATIONS.get(token, token))
+    return " ".join(normalized)
+
+
+def route_fingerprint(steps):
+    steps = [(mode.casefold(), normalize_name(drop_name), normalize_name(landmark)) for mode, drop_name, landmark in steps]
+    if not any(drop_name or landmark for _, drop_name, landmark in steps):
+        return ""
+    return hashlib.sha1("\n".join("|".join(step) for step in steps).encode()).hexdigest()
+
+
+def backfill(apps, schema_editor):
+    Route = apps.get_model("app", "Route")
+    RouteStep = apps.get_model("app", "RouteStep")
+    steps = defaultdict(list)
+    rows = RouteStep.objects.order_by("route_id", "order").values_list("route_id", "mode", "drop_name", "landmark")
+    for route_id, mode, drop_name, landmark in rows.iterator():
+        steps[route_id].append((mode, drop_name, landmark))
+    routes = [Route(pk=route_id, fingerprint=route_fingerprint(route_steps)) for route_id, route_steps in steps.items()]
+    Route.objects.bulk_update(routes, ["fingerprint"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_bundle_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='routesubmission',
+            name='approved_route',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='originating_submissions', to='app.route'),
+        ),
+        migrations.AddIndex(
+            model_name='route',
+            index=models.Index(fields=['destination', 'fingerprint'], name='app_route_fingerprint_idx'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.11 on 2026-10-17 00:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_route_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='routesubmission',
+            index=models.Index(condition=models.Q(('status', 'submitted')), fields=['created_at', 'id'], name='app_submission_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-17 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_approval_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='graph_generation',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='names_generation',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='routes_generation',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,11 +1,18 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db import transaction
 from django.utils import timezone
 from main.models import User
+from .names import normalize_name
 # Create your models here.
 class City(models.Model):
     name = models.CharField(max_length=100, unique=True)
     is_active = models.BooleanField(default=True)
+    # bumped after each commit that changes the city's search results, per-worker search index,
+    # place dictionary or route graph (app/search_cache.py); in the database so every
+    # worker sees them whatever cache backend it has
+    names_generation = models.PositiveBigIntegerField(default=0, editable=False)
+    routes_generation = models.PositiveBigIntegerField(default=0, editable=False)
+    graph_generation = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -16,14 +23,35 @@ class Place(models.Model):
         related_name="places"
     )
     canonical_name = models.CharField(max_length=200)
+    # normalize_name(canonical_name), kept in sync on save; all lookups match on this
+    normalized_name = models.CharField(max_length=200, editable=False)
     area = models.CharField(max_length=100, blank=True)
     description = models.TextField(blank=True)
+    # incoming + outgoing routes, maintained by signals; used to rank autocomplete results
+    route_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
     class Meta:
-        unique_together = ("city", "canonical_name")
+        constraints = [
+            # case/spelling-insensitive: "Wuse II" and "wuse 2" can't both exist in a city
+            models.UniqueConstraint(fields=["city", "normalized_name"], name="unique_place_normalized_name"),
+        ]
         indexes = [
-            models.Index(fields=["city", "canonical_name"]),
+            models.Index(fields=["city", "normalized_name"], name="app_place_city_normalized_idx"),
+            # offline bundle version and delta sync (app/bundles.py)
+            models.Index(fields=["city", "updated_at"], name="app_place_city_updated_idx"),
         ]
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.canonical_name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "canonical_name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "normalized_name"}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # aliases carry a copy of city for their (city, normalized_name) index
+            self.aliases.exclude(city_id=self.city_id).update(city_id=self.city_id)
+
     def __str__(self):
         return f"{self.canonical_name} ({self.city.name})"
 class PlaceAlias(models.Model):
@@ -32,10 +60,32 @@ class PlaceAlias(models.Model):
         on_delete=models.CASCADE,
         related_name="aliases"
     )
+    # denormalized from place.city so aliases can be looked up by (city, normalized_name)
+    city = models.ForeignKey(
+        City,
+        on_delete=models.CASCADE,
+        related_name="place_aliases",
+        editable=False
+    )
     name = models.CharField(max_length=200)
+    normalized_name = models.CharField(max_length=200, editable=False)
 
     class Meta:
-        unique_together = ("place", "name")
+        constraints = [
+            # per place, as before normalization: two places may share an alias ("Old Market")
+            models.UniqueConstraint(fields=["place", "normalized_name"], name="unique_alias_normalized_name"),
+        ]
+        indexes = [
+            models.Index(fields=["city", "normalized_name"], name="app_alias_city_normalized_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        self.city_id = self.place.city_id
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "normalized_name", "city"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -99,13 +149,14 @@ class RouteSubmission(models.Model):
     )
     reviewed_at = models.DateTimeField(null=True, blank=True)
 
-    # link to created route (set when approved)
-    approved_route = models.OneToOneField(
+    # link to the route this became (set when approved); several submissions of the same
+    # itinerary share one route, see Route.fingerprint
+    approved_route = models.ForeignKey(
         "Route",
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
-        related_name="originating_submission"
+        related_name="originating_submissions"
     )
 
     # new: keep the original submitted text so frontend can just send a name
@@ -115,6 +166,18 @@ class RouteSubmission(models.Model):
         help_text="Free-text starting point from the submitter (optional)"
     )
 
+    class Meta:
+        indexes = [
+            # newest-first keyset pages of the submissions list
+            models.Index(fields=["-created_at", "-id"], name="app_submission_created_idx"),
+            # the moderation queue: pending submissions oldest first; stays as small as the backlog
+            models.Index(
+                fields=["created_at", "id"],
+                condition=models.Q(status="submitted"),
+                name="app_submission_queue_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"Submission to {self.destination}"
 
@@ -130,40 +193,13 @@ class RouteSubmission(models.Model):
         if place.city_id != self.city_id:
             raise ValueError("Place city does not match submission city")
 
-        steps_qs = list(self.steps.all().order_by("order"))
-        if not steps_qs:
+        from .moderation import create_routes, load_steps
+        steps = load_steps([self.pk])
+        if not steps[self.pk]:
             raise ValueError("Cannot approve an empty submission (no steps)")
 
-        with transaction.atomic():
-            route = Route.objects.create(destination=place, recommended=False)
-            for step in steps_qs:
-                RouteStep.objects.create(
-                    route=route,
-                    order=step.order,
-                    mode=step.mode,
-                    instruction=step.instruction,
-                    drop_name=step.drop_name,
-                    landmark=step.landmark,
-                )
-
-            # attach resolved FK if present; otherwise attempt to resolve from starting_point_text
-            if self.starting_point_id:
-                route.starting_places.add(self.starting_point)
-            elif self.starting_point_text:
-                city = self.city
-                name = self.starting_point_text.strip()
-                sp = Place.objects.filter(city=city, canonical_name__iexact=name).first()
-                if not sp:
-                    alias = PlaceAlias.objects.filter(place__city=city, name__iexact=name).select_related("place").first()
-                    sp = alias.place if alias else Place.objects.create(city=city, canonical_name=name)
-                route.starting_places.add(sp)
-
-            self.approved_route = route
-            self.status = self.APPROVED
-            self.reviewed_by = reviewer
-            self.reviewed_at = timezone.now()
-            self.save()
-            return route
+        # the same bulk path as the moderation queue's bulk approve, for one submission
+        return create_routes([(self, place)], steps, reviewer)[self.pk]
 
     def reject(self, reviewer=None, notes=""):
         if self.status != self.SUBMITTED:
@@ -240,9 +276,48 @@ class Route(models.Model):
 
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # last change to anything in the route's document: also touched by step, fare and place
+    # writes (app.route_cache.touch_routes); drives the ETag/Last-Modified of route responses
+    updated_at = models.DateTimeField(auto_now=True)
+    # names.route_fingerprint of the steps, kept current by the RouteStep signals; approving a
+    # submission with the same (destination, fingerprint) adds its starting place to this route
+    fingerprint = models.CharField(max_length=40, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["destination", "fingerprint"], name="app_route_fingerprint_idx"),
+        ]
 
     def __str__(self):
         return f"Route to {self.destination.canonical_name} from {[p.canonical_name for p in self.starting_places.all()]}"
+class PlaceConnection(models.Model):
+    """
+    Destination -> starting place adjacency: how many routes reach `destination` from
+    `starting_place`. Maintained by signals on Route/starting_places so the starting-place
+    search never has to join through the routes.
+    """
+    destination = models.ForeignKey(
+        Place,
+        on_delete=models.CASCADE,
+        related_name="inbound_connections"
+    )
+    starting_place = models.ForeignKey(
+        Place,
+        on_delete=models.CASCADE,
+        related_name="outbound_connections"
+    )
+    route_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["destination", "starting_place"], name="unique_place_connection"),
+        ]
+        indexes = [
+            models.Index(fields=["destination", "-route_count"], name="app_connection_dest_count_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.starting_place_id} -> {self.destination_id} ({self.route_count} routes)"
 class RouteStep(models.Model):
     WALK = "walk"
     CAB = "cab"
@@ -278,6 +353,7 @@ class RouteStep(models.Model):
         max_length=200,
         blank=True
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["order"]
@@ -297,3 +373,156 @@ class StepFare(models.Model):
 
     amount = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # newest-first keyset pages of one step's fares
+            models.Index(fields=["route_step", "-created_at", "-id"], name="app_stepfare_step_created_idx"),
+        ]
+
+
+class FareEstimate(models.Model):
+    """
+    Decayed quantile sketch of all of a step's fares (app.fares.FareSketch) plus the band
+    it gives, so reads join one row instead of aggregating StepFare. Kept current by the
+    StepFare signals; rebuild with `manage.py rebuild_fare_estimates`.
+    """
+    route_step = models.OneToOneField(
+        RouteStep,
+        on_delete=models.CASCADE,
+        related_name="fare_estimate"
+    )
+
+    # null until the step has enough reports for an estimate
+    min_amount = models.PositiveIntegerField(null=True, blank=True)
+    max_amount = models.PositiveIntegerField(null=True, blank=True)
+    sample_size = models.PositiveIntegerField(default=0)
+    sketch = models.BinaryField(default=b"", editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def as_band(self):
+        if self.min_amount is None:
+            return None
+        return {
+            "currency": "NGN",
+            "min": self.min_amount,
+            "max": self.max_amount,
+            "sample_size": self.sample_size,
+        }
+
+    def __str__(self):
+        return f"{self.min_amount}-{self.max_amount} NGN ({self.sample_size} fares) for step {self.route_step_id}"
+
+
+class BundleTombstone(models.Model):
+    """
+    A place or route that left a city's offline bundle (deleted, or its destination moved
+    to another city), so delta syncs (app/bundles.py) can tell clients to drop it.
+    """
+    PLACE = "place"
+    ROUTE = "route"
+
+    city = models.ForeignKey(
+        City,
+        on_delete=models.CASCADE,
+        related_name="bundle_tombstones"
+    )
+    kind = models.CharField(max_length=10, choices=[(PLACE, "Place"), (ROUTE, "Route")])
+    object_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["city", "deleted_at"], name="app_tombstone_city_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} left city {self.city_id}"
+
+
+class ApprovalJob(models.Model):
+    """
+    A queued approval of a RouteSubmission (app/jobs.py). The approve endpoint only records
+    the job; `manage.py process_approval_jobs` resolves places and creates the routes in
+    batches. At most one job per submission can be pending, and a retried request with
+    the same idempotency key gets the job it created the first time.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    PENDING = (QUEUED, RUNNING)
+
+    submission = models.ForeignKey(
+        RouteSubmission,
+        on_delete=models.CASCADE,
+        related_name="approval_jobs"
+    )
+    reviewer = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="approval_jobs"
+    )
+    # ApproveSubmissionSerializer data: place_id / create_place
+    payload = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    route = models.ForeignKey(
+        Route,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="approval_jobs"
+    )
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # an admin double-click queues the submission once
+            models.UniqueConstraint(
+                fields=["submission"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_pending_approval_job",
+            ),
+        ]
+        indexes = [
+            # workers claim the oldest queued jobs
+            models.Index(fields=["created_at", "id"], condition=models.Q(status="queued"), name="app_approvaljob_queued_idx"),
+        ]
+
+    def __str__(self):
+        return f"Approval of submission {self.submission_id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key a create endpoint has seen (app/views.IdempotentCreateMixin): claimed
+    while the first request runs, then holding its response so retries reaching any worker
+    get it back. A row past expires_at no longer counts and is swept by the next claim.
+    """
+    # sha256 of the view's scope, the user and the client's key
+    key = models.CharField(max_length=64, unique=True)
+    # sha256 of the request body, so the key can't be replayed for a different request
+    request_hash = models.CharField(max_length=64)
+    # null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Idempotency key {self.key[:12]} ({'pending' if self.status_code is None else self.status_code})"
@@ -0,0 +1,196 @@
+from collections import defaultdict
+
+from django.db import DatabaseError, OperationalError, transaction
+from django.utils import timezone
+
+from .models import Place, Route, RouteStep, RouteStepSubmission, RouteSubmission
+from .names import normalize_name, route_fingerprint
+from .resolver import place_resolver
+from .signals import routes_bulk_created
+
+
+def load_steps(submission_ids):
+    """{submission_id: [RouteStepSubmission, ...]} in step order, in one query."""
+    steps = defaultdict(list)
+    for step in RouteStepSubmission.objects.filter(route_submission_id__in=submission_ids).order_by("route_submission_id", "order"):
+        steps[step.route_submission_id].append(step)
+    return steps
+
+
+def _starting_places(submissions):
+    """{submission_id: Place} for the submissions that name a starting point, resolved per city in batches."""
+    starting = {}
+    texts = defaultdict(dict)
+    for submission in submissions:
+        if submission.starting_point_id:
+            starting[submission.pk] = submission.starting_point_id
+        elif normalize_name(submission.starting_point_text):
+            texts[submission.city_id][submission.pk] = submission.starting_point_text
+    for city_id, names in texts.items():
+        resolved = place_resolver.resolve_many(city_id, names.values())
+        for submission_id, name in names.items():
+            starting[submission_id] = resolved[name].pk
+    return starting
+
+
+def create_routes(approvals, steps, reviewer=None):
+    """
+    Turn submissions into routes in a handful of queries however many there are: routes,
+    steps and starting-place links are bulk-created and the submissions bulk-updated.
+    A submission whose itinerary matches an existing route to the same destination
+    (same, non-blank Route.fingerprint) is merged into it: only its starting place is added.
+    `approvals` are (submission, destination Place) pairs of locked, submitted
+    submissions; `steps` comes from load_steps(). Returns {submission_id: Route}.
+    """
+    if not approvals:
+        return {}
+    starting = _starting_places([submission for submission, _ in approvals])
+    fingerprints = {
+        submission.pk: route_fingerprint((step.mode, step.drop_name, step.landmark) for step in steps[submission.pk])
+        for submission, _ in approvals
+    }
+    # a submission without a fingerprint gets a route of its own, even within the batch
+    keys = {
+        submission.pk: (place.pk, fingerprints[submission.pk] or f"submission:{submission.pk}")
+        for submission, place in approvals
+    }
+    now = timezone.now()
+    with transaction.atomic():
+        # (destination_id, fingerprint) -> route, the oldest if there are already duplicates
+        existing = {}
+        matches = Route.objects.filter(
+            destination_id__in={place.pk for _, place in approvals},
+            fingerprint__in=set(fingerprints.values()) - {""},
+        ).order_by("-id").only("id", "destination_id", "fingerprint")
+        for route in matches:
+            existing[(route.destination_id, route.fingerprint)] = route
+        merged_ids = {route.pk for route in existing.values()}
+
+        new_routes = {}
+        for submission, place in approvals:
+            key = keys[submission.pk]
+            # two submissions of the same itinerary in one batch share the new route too
+            if key not in existing and key not in new_routes:
+                new_routes[key] = (submission, Route(destination_id=place.pk, recommended=False, fingerprint=fingerprints[submission.pk]))
+        Route.objects.bulk_create(route for _, route in new_routes.values())
+        RouteStep.objects.bulk_create(
+            RouteStep(
+                route=route,
+                order=step.order,
+                mode=step.mode,
+                instruction=step.instruction,
+                drop_name=step.drop_name,
+                landmark=step.landmark,
+            )
+            for submission, route in new_routes.values()
+            for step in steps[submission.pk]
+        )
+
+        created = {}
+        links = set()
+        for submission, place in approvals:
+            key = keys[submission.pk]
+            route = existing[key] if key in existing else new_routes[key][1]
+            created[submission.pk] = route
+            if submission.pk in starting:
+                links.add((route.pk, route.destination_id, starting[submission.pk]))
+            submission.approved_route = route
+            submission.status = RouteSubmission.APPROVED
+            submission.reviewed_by = reviewer
+            submission.reviewed_at = now
+
+        # a merged route may already start there
+        through = Route.starting_places.through
+        linked = set(through.objects.filter(route_id__in=merged_ids).values_list("route_id", "place_id"))
+        links = sorted(link for link in links if (link[0], link[2]) not in linked)
+        through.objects.bulk_create(through(route_id=route_id, place_id=place_id) for route_id, _, place_id in links)
+        RouteSubmission.objects.bulk_update(
+            [submission for submission, _ in approvals],
+            ["approved_route", "status", "reviewed_by", "reviewed_at"],
+        )
+        routes_bulk_created(
+            [route for _, route in new_routes.values()],
+            [(destination_id, place_id) for _, destination_id, place_id in links],
+            {route_id for route_id, _, _ in links if route_id in merged_ids},
+        )
+    return created
+
+
+def bulk_approve(items, reviewer=None):
+    """
+    Approve many submissions at once. `items` are ApproveSubmissionSerializer payloads
+    plus an "id"; each is matched to a destination exactly like the single approve
+    (place_id, create_place, or resolved from the submitted name). Returns one result
+    per item, in order: {"id", "route_id"} or {"id", "error"}.
+
+    A database error caused by one item (a constraint or column limit it breaks) doesn't
+    sink the rest: the batch is rolled back and approved again one item at a time.
+    Operational errors (deadlocks, lost connections) are left to the caller to retry.
+    """
+    try:
+        return _approve(items, reviewer)
+    except OperationalError:
+        raise
+    except DatabaseError as error:
+        if len(items) == 1:
+            return [{"id": items[0]["id"], "error": str(error) or type(error).__name__}]
+        return [result for item in items for result in bulk_approve([item], reviewer=reviewer)]
+
+
+def _approve(items, reviewer):
+    results = {item["id"]: {"id": item["id"]} for item in items}
+    with transaction.atomic():
+        # one query locks every selected row
+        submissions = RouteSubmission.objects.select_for_update().in_bulk(list(results))
+        steps = load_steps([pk for pk, submission in submissions.items() if submission.status == RouteSubmission.SUBMITTED])
+
+        pending = []
+        for item in items:
+            submission = submissions.get(item["id"])
+            if submission is None:
+                results[item["id"]]["error"] = "Submission not found"
+            elif submission.status != RouteSubmission.SUBMITTED:
+                results[item["id"]]["error"] = "Submission not in submitted state"
+            elif not steps[submission.pk]:
+                results[item["id"]]["error"] = "Cannot approve an empty submission (no steps)"
+            else:
+                pending.append((submission, item))
+
+        destinations = _destinations(pending, results)
+        approvals = [(submission, destinations[submission.pk]) for submission, _ in pending if submission.pk in destinations]
+        for submission_id, route in create_routes(approvals, steps, reviewer).items():
+            results[submission_id]["route_id"] = route.pk
+    return [results[item["id"]] for item in items]
+
+
+def _destinations(pending, results):
+    """{submission_id: Place}: chosen places in one query, names resolved in one batch per city."""
+    destinations = {}
+    chosen = Place.objects.in_bulk({item["place_id"] for _, item in pending if item.get("place_id")})
+    # (city, area, fuzzy) -> {submission_id: name}
+    names = defaultdict(dict)
+    for submission, item in pending:
+        if item.get("place_id"):
+            place = chosen.get(item["place_id"])
+            if place is None:
+                results[submission.pk]["error"] = "Place not found"
+            elif place.city_id != submission.city_id:
+                results[submission.pk]["error"] = "Place city does not match submission city"
+            else:
+                destinations[submission.pk] = place
+        elif item.get("create_place"):
+            create_place = item["create_place"]
+            canonical = (create_place.get("canonical_name") or submission.destination).strip()
+            names[(submission.city_id, create_place.get("area", ""), False)][submission.pk] = canonical
+        else:
+            names[(submission.city_id, "", True)][submission.pk] = submission.destination
+
+    for (city_id, area, fuzzy), batch in names.items():
+        defaults = {} if fuzzy else {"area": area}
+        resolved = place_resolver.resolve_many(city_id, batch.values(), fuzzy=fuzzy, **defaults)
+        for submission_id, name in batch.items():
+            if name in resolved:
+                destinations[submission_id] = resolved[name]
+            else:
+                results[submission_id]["error"] = "Destination name has no letters or digits"
+    return destinations
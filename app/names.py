@@ -0,0 +1,55 @@
+import hashlib
+import re
+
+ROMAN_NUMERALS = {
+    "i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6",
+    "vii": "7", "viii": "8", "ix": "9", "x": "10", "xi": "11", "xii": "12",
+}
+
+ABBREVIATIONS = {
+    "rd": "road",
+    "st": "street",
+    "ave": "avenue",
+    "jn": "junction",
+    "jnc": "junction",
+    "jct": "junction",
+    "mkt": "market",
+}
+
+
+def normalize_name(name, partial=False):
+    """
+    Reduce a free-text place name to a comparable key:
+    "Wuse II", "wuse 2" and "Wuse-2" all become "wuse 2".
+    Roman numerals are only converted after the first token so "Ikeja" or "V" on its own survive.
+    With partial=True the last token is left as typed, for search-as-you-type
+    ("National St" must still find "National Stadium").
+    """
+    tokens = re.findall(r"[^\W_]+", (name or "").casefold())
+    normalized = []
+    for position, token in enumerate(tokens):
+        if partial and position == len(tokens) - 1:
+            normalized.append(token)
+            continue
+        if position and token in ROMAN_NUMERALS:
+            token = ROMAN_NUMERALS[token]
+        normalized.append(ABBREVIATIONS.get(token, token))
+    return " ".join(normalized)
+
+
+def query_variants(query):
+    """Normalized forms a search query should be matched under."""
+    return {variant for variant in (normalize_name(query), normalize_name(query, partial=True)) if variant}
+
+
+def route_fingerprint(steps):
+    """
+    Identity of a route's itinerary for spotting duplicates: a hash of each step's mode,
+    drop name and landmark, normalized, in order. `steps` are (mode, drop_name, landmark)
+    tuples. A route without steps, or whose steps name no stop or landmark (two bus rides
+    say nothing about where they go), has no fingerprint ("") and is never merged.
+    """
+    steps = [(mode.casefold(), normalize_name(drop_name), normalize_name(landmark)) for mode, drop_name, landmark in steps]
+    if not any(drop_name or landmark for _, drop_name, landmark in steps):
+        return ""
+    return hashlib.sha1("\n".join("|".join(step) for step in steps).encode()).hexdigest()
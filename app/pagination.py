@@ -0,0 +1,141 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite key, e.g. ("-created_at", "-id") or ("rank", "id").
+
+    The cursor holds the key values of the last row served and the next page is
+    `WHERE key > cursor ORDER BY key LIMIT n`, so every page costs the same however deep
+    the client goes (no OFFSET). Unlike DRF's CursorPagination, ties on the leading field
+    are broken by the remaining fields instead of an offset, which matters for search
+    where most rows share a rank.
+
+    Views set `ordering` (model fields or annotations, ending in a unique one) and may
+    override `page_size`.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, "ordering", None) or self.ordering)
+        self.limit = self.get_page_size(request, view)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self._after(position))
+            except (TypeError, ValueError, ValidationError):
+                # values the ordering's fields can't take, e.g. a string for an id
+                raise NotFound(self.invalid_cursor_message)
+
+        # one extra row tells us whether there is a next page
+        rows = list(queryset[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_page_size(self, request, view=None):
+        size = getattr(view, "page_size", None) or self.page_size
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, size))
+        except ValueError:
+            pass
+        return max(1, min(size, self.max_page_size))
+
+    def _after(self, position):
+        """(a, b, c) > (x, y, z) in the ordering's direction, spelled out for the ORM."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _position(self, row):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip("-")
+            # model instances, or .values() rows from the read fast path
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return values
+
+    def encode_cursor(self, row):
+        cursor = base64.urlsafe_b64encode(json.dumps(self._position(row), separators=(",", ":")).encode())
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor.decode())
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # ordering keys are never null; the cursor only ever holds scalars
+        if any(value is None or isinstance(value, (list, dict)) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor from the previous page's `next` link.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": f"Results per page (max {self.max_page_size}).",
+                "schema": {"type": "integer"},
+            },
+        ]
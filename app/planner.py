@@ -0,0 +1,215 @@
+import heapq
+from collections import defaultdict
+from threading import RLock
+
+from django.conf import settings
+
+from .models import Route, RouteStep
+from .search_cache import bump_generation, get_generation
+
+GRAPH = "graph"
+
+# cost of a step with no fare estimate yet, by mode (NGN)
+DEFAULT_STEP_FARE = {
+    RouteStep.WALK: 0,
+    RouteStep.KEKE: 200,
+    RouteStep.BIKE: 300,
+    RouteStep.BUS: 300,
+    RouteStep.CAB: 1000,
+}
+# every step (boarding, walking to the next stop) and every extra leg costs something even
+# when it is cheap, so shorter itineraries win ties
+STEP_PENALTY = 100
+LEG_PENALTY = 300
+
+
+def step_cost(mode, min_amount, max_amount):
+    if min_amount is None:
+        fare = DEFAULT_STEP_FARE.get(mode, 300)
+    else:
+        fare = (min_amount + max_amount) / 2
+    return fare + STEP_PENALTY
+
+
+class RouteGraph:
+    """
+    Directed graph of one city: an edge start -> destination for every starting place of
+    every route, weighted by the route's cost (fare estimate midpoints plus a per-step
+    penalty). Parallel routes between the same pair keep only the cheapest as the edge.
+    """
+
+    def __init__(self, city_id):
+        self.city_id = city_id
+        self.generation = None
+        self._lock = RLock()
+        # route_id -> (destination_id, starting place ids, cost)
+        self.routes = {}
+        # start -> destination -> {route_id: cost}
+        self.edges = defaultdict(lambda: defaultdict(dict))
+        # start -> destination -> (cost, route_id) of the cheapest of those routes
+        self.best = defaultdict(dict)
+
+    def build(self):
+        routes = Route.objects.filter(destination__city_id=self.city_id)
+        with self._lock:
+            self.routes = {}
+            self.edges = defaultdict(lambda: defaultdict(dict))
+            self.best = defaultdict(dict)
+            for route_id, data in self._load(routes).items():
+                self._add(route_id, *data)
+        return self
+
+    @staticmethod
+    def _load(routes):
+        """{route_id: (destination_id, starts, cost)} in three queries."""
+        loaded = {route_id: [destination_id, set(), 0] for route_id, destination_id in routes.values_list("id", "destination_id")}
+        through = Route.starting_places.through.objects.filter(route_id__in=routes.values("id"))
+        for route_id, place_id in through.values_list("route_id", "place_id"):
+            if route_id in loaded:
+                loaded[route_id][1].add(place_id)
+        steps = RouteStep.objects.filter(route_id__in=routes.values("id")).values_list(
+            "route_id", "mode", "fare_estimate__min_amount", "fare_estimate__max_amount"
+        )
+        for route_id, mode, low, high in steps:
+            if route_id in loaded:
+                loaded[route_id][2] += step_cost(mode, low, high)
+        return {route_id: tuple(data) for route_id, data in loaded.items()}
+
+    def _add(self, route_id, destination_id, starts, cost):
+        self.routes[route_id] = (destination_id, starts, cost)
+        for start in starts:
+            if start != destination_id:
+                self.edges[start][destination_id][route_id] = cost
+                self._pick(start, destination_id)
+
+    def _remove(self, route_id):
+        entry = self.routes.pop(route_id, None)
+        if entry is None:
+            return
+        destination_id, starts, _ = entry
+        for start in starts:
+            routes = self.edges.get(start, {}).get(destination_id)
+            if routes is not None:
+                routes.pop(route_id, None)
+                if not routes:
+                    del self.edges[start][destination_id]
+                self._pick(start, destination_id)
+
+    def _pick(self, start, destination_id):
+        routes = self.edges.get(start, {}).get(destination_id)
+        if routes:
+            route_id = min(routes, key=routes.get)
+            self.best[start][destination_id] = (routes[route_id], route_id)
+        else:
+            self.best.get(start, {}).pop(destination_id, None)
+
+    def refresh_routes(self, route_ids):
+        """Reload these routes (or drop them if deleted / no longer in this city)."""
+        loaded = self._load(Route.objects.filter(pk__in=route_ids, destination__city_id=self.city_id))
+        with self._lock:
+            for route_id in route_ids:
+                self._remove(route_id)
+                if route_id in loaded:
+                    self._add(route_id, *loaded[route_id])
+
+    def plan(self, start, destination, max_hops):
+        """
+        Itineraries from start to destination with at most max_hops legs, cheapest first:
+        [(cost, [(from_place, to_place, route_id), ...]), ...]. Dijkstra over (place, legs used);
+        after the cheapest, only itineraries with fewer legs are kept as alternatives.
+        """
+        with self._lock:
+            best = {(start, 0): 0}
+            previous = {}
+            settled = set()
+            found = []
+            queue = [(0, 0, start)]
+            while queue:
+                cost, hops, place = heapq.heappop(queue)
+                if (place, hops) in settled:
+                    continue
+                settled.add((place, hops))
+                if place == destination:
+                    # popped in cost order: only worth offering if it also needs fewer legs
+                    if not found or hops < len(found[-1][1]):
+                        legs = self._legs(previous, place, hops)
+                        if len({leg[0] for leg in legs}) == len(legs):
+                            found.append((cost, legs))
+                    continue
+                # past the legs of the last itinerary found nothing new can turn up
+                limit = len(found[-1][1]) - 1 if found else max_hops
+                if hops >= limit:
+                    continue
+                penalty = LEG_PENALTY if hops else 0
+                for target, (edge_cost, route_id) in self.best.get(place, {}).items():
+                    new_cost = cost + edge_cost + penalty
+                    state = (target, hops + 1)
+                    if new_cost < best.get(state, float("inf")):
+                        best[state] = new_cost
+                        previous[state] = (place, route_id)
+                        heapq.heappush(queue, (new_cost, hops + 1, target))
+        return found
+
+    @staticmethod
+    def _legs(previous, place, hops):
+        legs = []
+        while hops:
+            source, route_id = previous[(place, hops)]
+            legs.append((source, place, route_id))
+            place, hops = source, hops - 1
+        return legs[::-1]
+
+
+_graphs = {}
+_graphs_lock = RLock()
+
+
+def get_route_graph(city_id):
+    """This worker's graph for the city, rebuilt when another worker changed its routes."""
+    generation = get_generation(city_id, GRAPH)
+    graph = _graphs.get(city_id)
+    if graph is None or graph.generation != generation:
+        with _graphs_lock:
+            graph = _graphs.get(city_id)
+            if graph is None or graph.generation != generation:
+                graph = RouteGraph(city_id)
+                graph.generation = generation
+                _graphs[city_id] = graph.build()
+    return graph
+
+
+def drop_route_graph(city_id=None):
+    with _graphs_lock:
+        if city_id is None:
+            _graphs.clear()
+        else:
+            _graphs.pop(city_id, None)
+
+
+def routes_changed(route_ids, city_ids=()):
+    """
+    Patch this worker's loaded graphs with the current state of these routes and bump the
+    cities' graph generation on commit so other workers rebuild. `city_ids` adds cities the routes
+    just left (a destination moved or the route was deleted).
+    """
+    route_ids = set(route_ids) - {None}
+    if not route_ids:
+        return
+    cities = set(Route.objects.filter(pk__in=route_ids).values_list("destination__city_id", flat=True))
+    cities.update(city_ids)
+    for city_id in cities - {None}:
+        graph = _graphs.get(city_id)
+        if graph is not None:
+            graph.refresh_routes(route_ids)
+        bump_generation(city_id, GRAPH, then=lambda generation, city_id=city_id: _caught_up(city_id, generation))
+
+
+def _caught_up(city_id, generation):
+    # this worker's graph already has the committed change: move it along instead of rebuilding
+    graph = _graphs.get(city_id)
+    if graph is not None and graph.generation == generation - 1:
+        graph.generation = generation
+
+
+def max_hops():
+    return getattr(settings, "PLANNER_MAX_HOPS", 3)
@@ -0,0 +1,41 @@
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional: `pip install orjson`
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed, otherwise exactly the
+    stock renderer. Output is byte-for-byte what JSONRenderer produces for API data
+    (compact separators, UTF-8, "Z" for UTC datetimes); anything orjson doesn't know
+    natively (Decimal, lazy strings, ...) goes through DRF's encoder.
+    Enable with FAST_JSON_RENDERER = True.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            # ?indent= / browsable API: not a hot path
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes these two so the output is also valid JavaScript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+def json_renderer():
+    """The renderer for pre-rendered documents (route cache): fast one only when opted in."""
+    if getattr(settings, "FAST_JSON_RENDERER", False):
+        return FastJSONRenderer()
+    return JSONRenderer()
@@ -0,0 +1,114 @@
+from django.db.models import Value
+
+from . import signals
+from .matching import drop_place_dictionary, get_place_dictionary
+from .models import Place, PlaceAlias
+from .names import normalize_name
+
+
+class PlaceResolver:
+    """
+    Resolves free-text place names to Place rows: exact normalized name or alias first,
+    then a fuzzy match, then (optionally) a new Place.
+
+    Lookups go through the per-city normalized-name -> place_id dictionary from
+    app.matching (loaded once per worker, kept current by the Place/PlaceAlias signals),
+    so a warm resolve costs a single query to load the matched places. Names the
+    dictionary doesn't know are checked against the indexed normalized_name columns
+    before anything is created.
+    """
+
+    def resolve(self, city, name, create=True, fuzzy=True, **defaults):
+        return self.resolve_many(city, [name], create=create, fuzzy=fuzzy, **defaults).get(name)
+
+    def resolve_many(self, city, names, create=True, fuzzy=True, **defaults):
+        """
+        Return {name: Place} for every name with something left after normalize_name
+        ("!!!" names no place). Names that resolve to nothing are created when `create`
+        is set (with `defaults` such as area), otherwise left out.
+        """
+        city_id = getattr(city, "pk", city)
+        names = [name for name in dict.fromkeys(names) if name and normalize_name(name)]
+
+        matched = self._match(city_id, names, fuzzy)
+        places = Place.objects.in_bulk(set(matched.values()))
+        if len(places) < len(set(matched.values())):
+            # another worker deleted a place this dictionary still knows about
+            drop_place_dictionary(city_id)
+            matched = self._match(city_id, names, fuzzy)
+            places = Place.objects.in_bulk(set(matched.values()))
+
+        resolved = {name: places[pk] for name, pk in matched.items() if pk in places}
+        missing = [name for name in names if name not in resolved]
+        if missing:
+            # this worker's dictionary may lag behind writes made elsewhere: check the columns
+            resolved.update(self._lookup(city_id, missing))
+        if create:
+            new = {}
+            for name in names:
+                if name not in resolved:
+                    # two spellings of the same new place in one batch share a row
+                    new.setdefault(normalize_name(name), name.strip())
+            if new:
+                created = self._create(city_id, new, defaults)
+                for name in names:
+                    if name not in resolved:
+                        resolved[name] = created[normalize_name(name)]
+        return resolved
+
+    def _lookup(self, city_id, names):
+        """Exact (city, normalized_name) matches against places and aliases, in one query."""
+        keys = {normalize_name(name) for name in names}
+        canonical = (
+            Place.objects.filter(city_id=city_id, normalized_name__in=keys)
+            .annotate(kind=Value(0))
+            .values_list("kind", "normalized_name", "id")
+        )
+        aliases = (
+            PlaceAlias.objects.filter(city_id=city_id, normalized_name__in=keys)
+            .annotate(kind=Value(1))
+            .values_list("kind", "normalized_name", "place_id")
+        )
+        found = {}
+        # last one wins: canonical names over aliases, then the oldest place (as PlaceDictionary)
+        for _, key, place_id in sorted(canonical.union(aliases, all=True), key=lambda row: (row[0], row[2]), reverse=True):
+            found[key] = place_id
+        if not found:
+            return {}
+        places = Place.objects.in_bulk(set(found.values()))
+        return {
+            name: places[found[normalize_name(name)]]
+            for name in names
+            if found.get(normalize_name(name)) in places
+        }
+
+    def _create(self, city_id, names, defaults):
+        """
+        {normalized name: Place} for `names` ({normalized name: name}), created with one
+        INSERT. A place a concurrent request created first is kept (the unique (city,
+        normalized_name) constraint skips ours) and read back with the rest.
+        """
+        Place.objects.bulk_create(
+            [Place(city_id=city_id, canonical_name=name, normalized_name=key, **defaults) for key, name in names.items()],
+            ignore_conflicts=True,
+        )
+        places = {place.normalized_name: place for place in Place.objects.filter(city_id=city_id, normalized_name__in=names)}
+        signals.places_bulk_created(city_id, places.values())
+        return places
+
+    def _match(self, city_id, names, fuzzy):
+        dictionary = get_place_dictionary(city_id)
+        matched = {}
+        for name in names:
+            if fuzzy:
+                match = dictionary.match(name)
+                if match is not None:
+                    matched[name] = match[0]
+            else:
+                place_id = dictionary.exact(name)
+                if place_id is not None:
+                    matched[name] = place_id
+        return matched
+
+
+place_resolver = PlaceResolver()
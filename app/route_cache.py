@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Place, Route, RouteStep
+from .renderers import json_renderer
+from .serializers import read_routes
+
+# Each route's RouteSerializer output is kept as rendered JSON under its id and updated_at.
+# Writes to the route, its steps, fares or places move updated_at (app/signals.py), so a
+# changed route is simply looked up under a new key, by every worker whatever cache backend
+# it has; stale documents expire on their own.
+
+
+def _micros(updated_at):
+    return int(updated_at.timestamp() * 1_000_000)
+
+
+def _document_key(route_id, updated_at):
+    return f"route:doc:{route_id}:{_micros(updated_at)}"
+
+
+def touch_routes(route_ids):
+    """A step, fare or place in these routes changed: move their updated_at, retiring their documents."""
+    route_ids = set(route_ids) - {None}
+    if not route_ids:
+        return
+    Route.objects.filter(pk__in=route_ids).update(updated_at=timezone.now())
+
+
+def route_etag(route_id, updated_at):
+    """Strong validator for one route's document; changes whenever updated_at does."""
+    return f'"route-{route_id}-{_micros(updated_at)}"'
+
+
+def with_route_details(routes):
+    """
+    Everything RouteSerializer reads, in three queries however many routes there are:
+    routes + destination, steps + fare estimate, starting places. Budget checked in app/tests.py.
+    """
+    return routes.select_related("destination").prefetch_related(
+        Prefetch("steps", queryset=RouteStep.objects.select_related("fare_estimate").defer("fare_estimate__sketch")),
+        Prefetch("starting_places", queryset=Place.objects.only("id", "canonical_name").order_by("id")),
+    )
+
+
+def render_routes(route_ids):
+    """{route_id: JSON bytes} of RouteSerializer's output, built by the read_routes() fast path."""
+    renderer = json_renderer()
+    return {route_id: renderer.render(data) for route_id, data in read_routes(route_ids).items()}
+
+
+def route_documents(routes):
+    """
+    {route_id: JSON bytes} of RouteSerializer output for each existing route, from the
+    cache where possible; misses are serialized in one batch and stored. `routes` is
+    {route_id: updated_at}, or route ids whose updated_at is read in one query.
+    """
+    if not isinstance(routes, dict):
+        routes = dict(Route.objects.filter(pk__in=set(routes)).values_list("id", "updated_at"))
+    keys = {_document_key(route_id, updated_at): route_id for route_id, updated_at in routes.items()}
+    documents = {keys[key]: document for key, document in cache.get_many(keys).items()}
+
+    missing = [route_id for route_id in routes if route_id not in documents]
+    if missing:
+        rendered = render_routes(missing)
+        cache.set_many(
+            {_document_key(route_id, routes[route_id]): document for route_id, document in rendered.items()},
+            getattr(settings, "ROUTE_DOCUMENT_TIMEOUT", 86400),
+        )
+        documents.update(rendered)
+    return documents
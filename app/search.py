@@ -0,0 +1,348 @@
+import operator
+from collections import defaultdict
+from functools import lru_cache, reduce
+from threading import RLock
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Place, PlaceAlias
+from .names import normalize_name, query_variants
+from .search_cache import get_generation
+
+NGRAM_SIZE = 3
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    if len(text) < n:
+        return set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class PlaceIndex:
+    """
+    In-memory trigram index over the normalized canonical names and aliases of one city's places.
+    search() returns the ids of places whose normalized name or any alias contains the
+    normalized query, without touching the database.
+    """
+
+    def __init__(self, city_id):
+        self.city_id = city_id
+        self.generation = None
+        self._lock = RLock()
+        # (kind, pk) -> (place_id, normalized name); kind is "place" or "alias"
+        self._entries = {}
+        self._postings = defaultdict(set)
+
+    def build(self):
+        entries = {}
+        for pk, name in Place.objects.filter(city_id=self.city_id).values_list("id", "normalized_name"):
+            entries[("place", pk)] = (pk, name)
+        aliases = PlaceAlias.objects.filter(city_id=self.city_id).values_list("id", "place_id", "normalized_name")
+        for pk, place_id, name in aliases:
+            entries[("alias", pk)] = (place_id, name)
+
+        postings = defaultdict(set)
+        for key, (_, name) in entries.items():
+            for gram in ngrams(name):
+                postings[gram].add(key)
+
+        with self._lock:
+            self._entries = entries
+            self._postings = postings
+        return self
+
+    def add(self, kind, pk, place_id, name):
+        with self._lock:
+            self.remove(kind, pk)
+            self._entries[(kind, pk)] = (place_id, name)
+            for gram in ngrams(name):
+                self._postings[gram].add((kind, pk))
+
+    def remove(self, kind, pk):
+        with self._lock:
+            entry = self._entries.pop((kind, pk), None)
+            if entry is None:
+                return
+            for gram in ngrams(entry[1]):
+                keys = self._postings.get(gram)
+                if keys is not None:
+                    keys.discard((kind, pk))
+                    if not keys:
+                        del self._postings[gram]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def search(self, query):
+        place_ids = set()
+        for variant in query_variants(query):
+            place_ids |= self._search(variant)
+        return place_ids
+
+    def _search(self, query):
+        with self._lock:
+            grams = ngrams(query)
+            if grams:
+                # intersect the smallest posting lists first
+                candidates = None
+                for gram in sorted(grams, key=lambda g: len(self._postings.get(g, ()))):
+                    keys = self._postings.get(gram)
+                    if not keys:
+                        return set()
+                    candidates = set(keys) if candidates is None else candidates & keys
+                    if not candidates:
+                        return set()
+            else:
+                # queries shorter than one trigram: scan the city's names in memory
+                candidates = self._entries.keys()
+
+            return {
+                self._entries[key][0]
+                for key in candidates
+                if query in self._entries[key][1]
+            }
+
+
+_indexes = {}
+_indexes_lock = RLock()
+
+
+def get_place_index(city_id):
+    """
+    Return this worker's index for the city, building it on first use or when another
+    worker has written places since (the city's names generation moved past ours).
+    """
+    generation = get_generation(city_id)
+    index = _indexes.get(city_id)
+    if index is None or index.generation != generation:
+        with _indexes_lock:
+            index = _indexes.get(city_id)
+            if index is None or index.generation != generation:
+                index = PlaceIndex(city_id)
+                index.generation = generation
+                _indexes[city_id] = index.build()
+    return index
+
+
+def loaded_index(city_id):
+    """Return the index only if this worker has already built it (used by signal handlers)."""
+    return _indexes.get(city_id)
+
+
+def loaded_indexes():
+    return list(_indexes.values())
+
+
+def drop_place_index(city_id=None):
+    with _indexes_lock:
+        if city_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(city_id, None)
+
+
+def name_contains(variants):
+    """Places whose normalized name, or one of whose aliases' normalized names, contains a variant."""
+    contains = reduce(operator.or_, (Q(normalized_name__contains=variant) for variant in variants))
+    return contains | Q(id__in=PlaceAlias.objects.filter(contains).values("place_id"))
+
+
+class SearchBackend:
+    """
+    Filters a Place queryset down to places whose canonical name or an alias matches `query`.
+    Backends only narrow the queryset; callers keep control of ordering and serialization.
+    """
+
+    def filter(self, queryset, query, city_id=None):
+        raise NotImplementedError
+
+    def reindex(self):
+        pass
+
+
+class IContainsSearchBackend(SearchBackend):
+    """The original LIKE '%q%' scan across the alias join. Kept as fallback and benchmark baseline."""
+
+    def filter(self, queryset, query, city_id=None):
+        return queryset.filter(
+            Q(canonical_name__icontains=query) |
+            Q(aliases__name__icontains=query)
+        ).distinct()
+
+
+class MemorySearchBackend(SearchBackend):
+    """Answers from the per-worker trigram PlaceIndex."""
+
+    def filter(self, queryset, query, city_id=None):
+        if city_id is not None:
+            city_ids = [city_id]
+        else:
+            city_ids = queryset.values_list("city_id", flat=True).distinct()
+        place_ids = set()
+        for cid in city_ids:
+            place_ids |= get_place_index(cid).search(query)
+        return queryset.filter(id__in=place_ids)
+
+    def reindex(self):
+        drop_place_index()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    pg_trgm GIN indexes on normalized_name serve the substring filters, and the generated
+    search_vector columns add word-prefix matches regardless of word order.
+    Indexes and columns are created by migrations 0005 and 0007.
+    """
+
+    def filter(self, queryset, query, city_id=None):
+        variants = query_variants(query)
+        if not variants:
+            return queryset.none()
+
+        condition = name_contains(variants)
+        tsquery = self._tsquery(query)
+        if tsquery:
+            condition |= Q(id__in=RawSQL(
+                "SELECT id FROM app_place WHERE search_vector @@ to_tsquery('simple', %s)"
+                " UNION SELECT place_id FROM app_placealias WHERE search_vector @@ to_tsquery('simple', %s)",
+                [tsquery, tsquery],
+            ))
+        return queryset.filter(condition)
+
+    @staticmethod
+    def _tsquery(query):
+        tokens = normalize_name(query, partial=True).split()
+        return " & ".join(f"{token}:*" for token in tokens)
+
+    def reindex(self):
+        with connection.cursor() as cursor:
+            cursor.execute("REINDEX TABLE app_place")
+            cursor.execute("REINDEX TABLE app_placealias")
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 trigram table (app_place_fts) holding one row per normalized canonical name and
+    alias, kept in sync by triggers. Trigram MATCH needs at least 3 characters, shorter
+    queries use a plain substring filter on the normalized columns.
+    """
+
+    def filter(self, queryset, query, city_id=None):
+        variants = query_variants(query)
+        if not variants:
+            return queryset.none()
+
+        if min(len(variant) for variant in variants) < NGRAM_SIZE:
+            return queryset.filter(name_contains(variants))
+
+        sql = "SELECT place_id FROM app_place_fts WHERE app_place_fts MATCH %s"
+        params = [" OR ".join('"' + variant.replace('"', '""') + '"' for variant in sorted(variants))]
+        if city_id is not None:
+            sql += " AND city_id = %s"
+            params.append(city_id)
+        return queryset.filter(id__in=RawSQL(sql, params))
+
+    def reindex(self, using="default"):
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM app_place_fts")
+            cursor.execute(
+                "INSERT INTO app_place_fts(rowid, name, place_id, city_id) "
+                "SELECT id * 2, normalized_name, id, city_id FROM app_place"
+            )
+            cursor.execute(
+                "INSERT INTO app_place_fts(rowid, name, place_id, city_id) "
+                "SELECT id * 2 + 1, normalized_name, place_id, city_id FROM app_placealias"
+            )
+
+
+SQLITE_FTS_TRIGGERS = {
+    "app_place_fts_ai": """CREATE TRIGGER IF NOT EXISTS app_place_fts_ai AFTER INSERT ON app_place BEGIN
+        INSERT INTO app_place_fts(rowid, name, place_id, city_id) VALUES (new.id * 2, new.normalized_name, new.id, new.city_id);
+    END""",
+    "app_place_fts_au": """CREATE TRIGGER IF NOT EXISTS app_place_fts_au AFTER UPDATE ON app_place BEGIN
+        UPDATE app_place_fts SET name = new.normalized_name, city_id = new.city_id WHERE rowid = new.id * 2;
+    END""",
+    "app_place_fts_ad": """CREATE TRIGGER IF NOT EXISTS app_place_fts_ad AFTER DELETE ON app_place BEGIN
+        DELETE FROM app_place_fts WHERE rowid = old.id * 2;
+    END""",
+    "app_placealias_fts_ai": """CREATE TRIGGER IF NOT EXISTS app_placealias_fts_ai AFTER INSERT ON app_placealias BEGIN
+        INSERT INTO app_place_fts(rowid, name, place_id, city_id) VALUES (new.id * 2 + 1, new.normalized_name, new.place_id, new.city_id);
+    END""",
+    "app_placealias_fts_au": """CREATE TRIGGER IF NOT EXISTS app_placealias_fts_au AFTER UPDATE ON app_placealias BEGIN
+        UPDATE app_place_fts SET name = new.normalized_name, place_id = new.place_id, city_id = new.city_id
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    "app_placealias_fts_ad": """CREATE TRIGGER IF NOT EXISTS app_placealias_fts_ad AFTER DELETE ON app_placealias BEGIN
+        DELETE FROM app_place_fts WHERE rowid = old.id * 2 + 1;
+    END""",
+}
+
+
+def ensure_sqlite_fts(using="default"):
+    """
+    SQLite drops a table's triggers whenever a migration rebuilds it (most AlterField/AddField
+    on app_place do). Run after migrate: puts missing FTS triggers back and refills the table.
+    """
+    conn = connections[using]
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'app_place_fts'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        present = {row[0] for row in cursor.fetchall()}
+        if present >= set(SQLITE_FTS_TRIGGERS):
+            return
+        for sql in SQLITE_FTS_TRIGGERS.values():
+            cursor.execute(sql)
+    SQLiteSearchBackend().reindex(using)
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """Picks the native backend for the configured database vendor."""
+
+    vendors = {
+        "postgresql": PostgresSearchBackend,
+        "sqlite": SQLiteSearchBackend,
+    }
+
+    def __init__(self):
+        self.backend = self.vendors.get(connection.vendor, IContainsSearchBackend)()
+
+    def filter(self, queryset, query, city_id=None):
+        return self.backend.filter(queryset, query, city_id)
+
+    def reindex(self):
+        self.backend.reindex()
+
+
+def rank_matches(queryset, query):
+    """
+    Annotate `rank` on places already filtered by a backend: 0 exact name, 1 name prefix,
+    2 name substring, 3 matched only through an alias. Ties break on popularity (route_count).
+    """
+    variants = query_variants(query)
+    if not variants:
+        return queryset.annotate(rank=Value(3)).order_by("rank", "id")
+    starts = reduce(operator.or_, (Q(normalized_name__startswith=variant) for variant in variants))
+    contains = reduce(operator.or_, (Q(normalized_name__contains=variant) for variant in variants))
+    return queryset.annotate(
+        rank=Case(
+            When(normalized_name__in=variants, then=Value(0)),
+            When(starts, then=Value(1)),
+            When(contains, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    ).order_by("rank", "-route_count", "canonical_name", "id")
+
+
+@lru_cache(maxsize=None)
+def get_search_backend(path=None):
+    path = path or getattr(settings, "PLACE_SEARCH_BACKEND", "app.search.DatabaseSearchBackend")
+    return import_string(path)()
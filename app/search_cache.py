@@ -0,0 +1,143 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import City, Place
+
+# Three counters per city, kept on the City row so every worker reads the same values
+# whatever cache backend it has:
+#   names  - bumped on Place/PlaceAlias writes; the per-worker PlaceIndex and PlaceDictionary
+#            compare against it to notice writes made by other workers
+#   routes - bumped on Route/starting_places writes (they change starting-place results and
+#            popularity ranking, but not names)
+#   graph  - bumped on writes that change the planner's route graph (app/planner.py)
+# Search results are cached under names and routes, so a write makes every older entry unreachable.
+NAMES = "names"
+ROUTES = "routes"
+
+
+def _generation_field(kind):
+    return f"{kind}_generation"
+
+
+def get_generation(city_id, kind=NAMES):
+    """The city's `kind` counter in one query; None if there is no such city."""
+    return City.objects.filter(pk=city_id).values_list(_generation_field(kind), flat=True).first()
+
+
+class _GenerationBump:
+    """One scheduled bump of a city counter, shared by every write of the transaction."""
+
+    def __init__(self, city_id, kind):
+        self.key = (city_id, kind)
+        self.callbacks = []
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        city_id, kind = self.key
+        field = _generation_field(kind)
+        City.objects.filter(pk=city_id).update(**{field: F(field) + 1})
+        generation = get_generation(city_id, kind)
+        for callback in self.callbacks:
+            callback(generation)
+
+
+def bump_generation(city_id, kind=NAMES, then=None):
+    """
+    Bump the city's `kind` counter once the current transaction commits (at once outside
+    one), in its own short UPDATE: writers never queue behind each other on the City row,
+    and however many writes a transaction makes the counter moves once. `then(generation)`
+    runs after the bump. A rolled-back transaction bumps nothing, so structures patched by
+    its writes keep their generation until the next real bump makes them rebuild.
+    """
+    if city_id is None:
+        return
+    connection = transaction.get_connection()
+    for _, scheduled, _ in connection.run_on_commit:
+        if isinstance(scheduled, _GenerationBump) and scheduled.key == (city_id, kind) and not scheduled.done:
+            if then is not None:
+                scheduled.callbacks.append(then)
+            return
+    bump = _GenerationBump(city_id, kind)
+    if then is not None:
+        bump.callbacks.append(then)
+    transaction.on_commit(bump)
+
+
+def get_generations(city_ids):
+    """{city_id: (names, routes)} in one query."""
+    rows = City.objects.filter(pk__in=city_ids).values_list("id", "names_generation", "routes_generation")
+    return {city_id: (names, routes) for city_id, names, routes in rows}
+
+
+class SearchCache:
+    """
+    Serialized search results keyed by (endpoint, city, generations, normalized query, page).
+    Hit/miss/write counters are kept per endpoint in the cache so stats() covers all workers
+    sharing it. They are running totals since the counters were created: entries that have
+    expired or were retired by a generation bump are still counted in the write totals.
+    """
+
+    registry = {}
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.registry[endpoint] = self
+
+    @property
+    def timeout(self):
+        return getattr(settings, "SEARCH_CACHE_TIMEOUT", 600)
+
+    def key(self, city_id, parts):
+        """Cache key for one result; it changes with the city's generations, so it doubles as an ETag."""
+        names, routes = get_generations([city_id]).get(city_id, (None, None))
+        digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+        return f"search:result:{self.endpoint}:{city_id}:{names}:{routes}:{digest}"
+
+    def _count(self, stat, amount=1):
+        key = f"search:stats:{self.endpoint}:{stat}"
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.add(key, 0, None)
+            cache.incr(key, amount)
+
+    def get(self, key):
+        content = cache.get(key)
+        self._count("hits" if content is not None else "misses")
+        return content
+
+    def set(self, key, content):
+        cache.set(key, content, self.timeout)
+        self._count("entries_written_total")
+
+    def stats(self):
+        names = ("hits", "misses", "entries_written_total")
+        values = cache.get_many([f"search:stats:{self.endpoint}:{stat}" for stat in names])
+        stats = {stat: values.get(f"search:stats:{self.endpoint}:{stat}", 0) for stat in names}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+def place_city_id(place_id):
+    """City of a place, cached so cache hits for per-destination searches need no query."""
+    key = f"search:place-city:{place_id}"
+    city_id = cache.get(key)
+    if city_id is None:
+        city_id = Place.objects.filter(pk=place_id).values_list("city_id", flat=True).first()
+        if city_id is not None:
+            cache.set(key, city_id, None)
+    return city_id
+
+
+def forget_place_city(place_id):
+    cache.delete(f"search:place-city:{place_id}")
+
+
+def search_cache_stats():
+    return {endpoint: search_cache.stats() for endpoint, search_cache in sorted(SearchCache.registry.items())}
@@ -1,5 +1,15 @@
+from collections import defaultdict
+
 from rest_framework import serializers
 from .models import *
+from .names import normalize_name
+from .resolver import place_resolver
+
+
+def place_name(value):
+    """Field validator: the resolver keys places by normalize_name, so "!!!" can't name one."""
+    if value and not normalize_name(value):
+        raise serializers.ValidationError("A place name needs at least one letter or digit.")
 
 class PlaceAutocompleteSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,22 +34,11 @@ class RouteStepSerializer(serializers.ModelSerializer):
         ]
 
     def get_estimated_fare(self, obj):
-        fares = obj.fares.order_by("-created_at")[:30]
-        amounts = [f.amount for f in fares]
-
-        if len(amounts) < 3:
+        # stored by app.fares; views select_related("fare_estimate") so this is a join, not a query
+        try:
+            return obj.fare_estimate.as_band()
+        except FareEstimate.DoesNotExist:
             return None
-
-        amounts.sort()
-        lower = amounts[int(len(amounts) * 0.2)]
-        upper = amounts[int(len(amounts) * 0.8)]
-
-        return {
-            "currency": "NGN",
-            "min": lower,
-            "max": upper,
-            "sample_size": len(amounts),
-        }
 class PlaceSearchSerializer(serializers.ModelSerializer):
     class Meta:
         model = Place
@@ -117,12 +116,45 @@ class ApproveSubmissionSerializer(serializers.Serializer):
         cp = data.get("create_place")
         if cp and not cp.get("canonical_name"):
             raise serializers.ValidationError({"create_place": "canonical_name is required when creating a place"})
+        if cp:
+            try:
+                place_name(cp["canonical_name"])
+            except serializers.ValidationError as error:
+                raise serializers.ValidationError({"create_place": error.detail})
+        for field in ("canonical_name", "area"):
+            max_length = Place._meta.get_field(field).max_length
+            if cp and len(cp.get(field, "")) > max_length:
+                raise serializers.ValidationError({"create_place": f"{field} must be at most {max_length} characters"})
         return data
 
+class BulkApproveItemSerializer(ApproveSubmissionSerializer):
+    id = serializers.IntegerField(min_value=1)
+
+class BulkApproveSubmissionSerializer(serializers.Serializer):
+    submissions = BulkApproveItemSerializer(many=True, allow_empty=False, max_length=200)
+
+    def validate_submissions(self, items):
+        ids = [item["id"] for item in items]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each submission can only be listed once")
+        return items
+
+class ApprovalJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ApprovalJob
+        fields = ["id", "submission", "status", "route", "error", "created_at", "finished_at"]
+
 class RejectSubmissionSerializer(serializers.Serializer):
     admin_notes = serializers.CharField(required=False, allow_blank=True)
 
-class StepFareSerializer(serializers.Serializer):
+class RoutePairSerializer(serializers.Serializer):
+    start = serializers.IntegerField(min_value=1)
+    destination = serializers.IntegerField(min_value=1)
+
+class BatchRouteLookupSerializer(serializers.Serializer):
+    pairs = RoutePairSerializer(many=True, allow_empty=False, max_length=50)
+
+class StepFareSerializer(serializers.ModelSerializer):
     class Meta:
         model = StepFare
         fields = [
@@ -131,7 +163,8 @@ class StepFareSerializer(serializers.Serializer):
             "amount",
             "created_at",
         ]
-        read_only_fields = ["id", "created_at"]
+        # the step comes from the URL
+        read_only_fields = ["id", "route_step", "created_at"]
 
 class RouteStepSubmissionCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -144,7 +177,7 @@ class RouteSubmissionCreateSerializer(serializers.ModelSerializer):
 
     # keep optional FK for clients that can provide it, and accept free-text
     starting_point = serializers.PrimaryKeyRelatedField(queryset=Place.objects.all(), required=False, allow_null=True)
-    starting_point_text = serializers.CharField(write_only=True, required=False, allow_blank=True)
+    starting_point_text = serializers.CharField(write_only=True, required=False, allow_blank=True, validators=[place_name])
 
     class Meta:
         model = RouteSubmission
@@ -161,6 +194,7 @@ class RouteSubmissionCreateSerializer(serializers.ModelSerializer):
             "steps",
         ]
         read_only_fields = ["id", "status", "created_at"]
+        extra_kwargs = {"destination": {"validators": [place_name]}}
 
     def create(self, validated_data):
         steps_data = validated_data.pop("steps", [])
@@ -168,16 +202,8 @@ class RouteSubmissionCreateSerializer(serializers.ModelSerializer):
         starting_point_text = validated_data.pop("starting_point_text", None)
 
         # Resolve text -> Place if text provided and FK not provided
-        if not starting_point and starting_point_text:
-            city = validated_data.get("city")
-            name = starting_point_text.strip()
-            starting_point = Place.objects.filter(city=city, canonical_name__iexact=name).first()
-            if not starting_point:
-                alias = PlaceAlias.objects.filter(place__city=city, name__iexact=name).select_related("place").first()
-                if alias:
-                    starting_point = alias.place
-            if not starting_point:
-                starting_point = Place.objects.create(city=city, canonical_name=name)
+        if not starting_point and starting_point_text and starting_point_text.strip():
+            starting_point = place_resolver.resolve(validated_data.get("city"), starting_point_text)
 
         if starting_point is not None:
             validated_data["starting_point"] = starting_point
@@ -205,6 +231,7 @@ class SubmissionEditSerializer(serializers.ModelSerializer):
             "steps",
         ]
         read_only_fields = ["id"]
+        extra_kwargs = {"destination": {"validators": [place_name]}, "starting_point_text": {"validators": [place_name]}}
 
     def update(self, instance, validated_data):
         steps_data = validated_data.pop("steps", [])
@@ -216,4 +243,61 @@ class SubmissionEditSerializer(serializers.ModelSerializer):
         instance.steps.all().delete()
         objs = [RouteStepSubmission(route_submission=instance, **step) for step in steps_data]
         RouteStepSubmission.objects.bulk_create(objs)
-        return instance
\ No newline at end of file
+        return instance
+
+
+# Read-only fast path. RouteSerializer/RouteStepSerializer/PlaceSearchSerializer introspect
+# fields on every object; the functions below build the same dicts (same keys, order and
+# types, so the rendered JSON is identical) straight from .values() rows. Keep them in
+# step with the serializers above; app/tests.py compares the two.
+
+def rows_data(rows, fields):
+    """PlaceSearchSerializer / PlaceAutocompleteSerializer output from .values() rows of their fields."""
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def read_routes(route_ids):
+    """{route_id: RouteSerializer-shaped dict} in three queries."""
+    route_ids = list(route_ids)
+    starting_places = defaultdict(list)
+    through = Route.starting_places.through.objects.filter(route_id__in=route_ids).order_by("place_id")
+    for route_id, place_id, name in through.values_list("route_id", "place_id", "place__canonical_name"):
+        starting_places[route_id].append({"id": place_id, "canonical_name": name})
+
+    steps = defaultdict(list)
+    step_rows = RouteStep.objects.filter(route_id__in=route_ids).order_by("route_id", "order").values_list(
+        "route_id", "order", "mode", "instruction", "drop_name", "landmark",
+        "fare_estimate__min_amount", "fare_estimate__max_amount", "fare_estimate__sample_size",
+    )
+    for route_id, order, mode, instruction, drop_name, landmark, low, high, sample_size in step_rows:
+        steps[route_id].append({
+            "order": order,
+            "mode": mode,
+            "instruction": instruction,
+            "drop_name": drop_name,
+            "landmark": landmark,
+            "estimated_fare": None if low is None else {
+                "currency": "NGN",
+                "min": low,
+                "max": high,
+                "sample_size": sample_size,
+            },
+        })
+
+    routes = Route.objects.filter(pk__in=route_ids).values_list(
+        "id", "destination_id", "destination__canonical_name",
+        "recommended", "estimated_time", "difficulty", "notes",
+    )
+    return {
+        route_id: {
+            "id": route_id,
+            "destination": {"id": destination_id, "canonical_name": destination_name},
+            "starting_places": starting_places[route_id],
+            "recommended": recommended,
+            "estimated_time": estimated_time,
+            "difficulty": difficulty,
+            "notes": notes,
+            "steps": steps[route_id],
+        }
+        for route_id, destination_id, destination_name, recommended, estimated_time, difficulty, notes in routes
+    }
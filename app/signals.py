@@ -0,0 +1,345 @@
+import operator
+from collections import Counter, defaultdict
+from functools import reduce
+
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import bundles, cities, fares, matching, planner, route_cache, search, search_cache
+from .models import BundleTombstone, City, Place, PlaceAlias, PlaceConnection, Route, RouteStep, StepFare
+from .names import route_fingerprint
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def refresh_cities(sender, instance, **kwargs):
+    cities.drop_city_map()
+    if not instance.is_active or kwargs.get("signal") is post_delete:
+        # no longer searchable: free this worker's structures for it
+        search.drop_place_index(instance.pk)
+        matching.drop_place_dictionary(instance.pk)
+
+
+def _names_changed(city_id):
+    """
+    Bump the city's names generation on commit so other workers rebuild their index and
+    dictionary, and cached search results for the city stop matching. This worker has
+    already patched its own structures, so they move to the new generation instead of
+    being rebuilt.
+    """
+    search_cache.bump_generation(city_id, then=lambda generation: _caught_up(city_id, generation))
+
+
+def _caught_up(city_id, generation):
+    for structure in (search.loaded_index(city_id), matching.loaded_dictionary(city_id)):
+        if structure is not None and structure.generation == generation - 1:
+            structure.generation = generation
+
+
+@receiver(post_save, sender=Place)
+def index_place(sender, instance, **kwargs):
+    for index in search.loaded_indexes():
+        if index.city_id != instance.city_id and ("place", instance.pk) in index:
+            # place moved to another city: its aliases moved too, rebuild lazily
+            search.drop_place_index(index.city_id)
+    index = search.loaded_index(instance.city_id)
+    if index is not None:
+        index.add("place", instance.pk, instance.pk, instance.normalized_name)
+
+    dictionary = matching.loaded_dictionary(instance.city_id)
+    if kwargs.get("created") and dictionary is not None:
+        dictionary.add_key(instance.normalized_name, instance.pk)
+    elif not kwargs.get("created"):
+        # renames can't be patched into the dictionary, reload on next use
+        matching.drop_place_dictionary()
+    search_cache.forget_place_city(instance.pk)
+    _names_changed(instance.city_id)
+
+
+def places_bulk_created(city_id, places):
+    """What the Place signals do for new places made with bulk_create (which sends none)."""
+    index = search.loaded_index(city_id)
+    dictionary = matching.loaded_dictionary(city_id)
+    for place in places:
+        if index is not None:
+            index.add("place", place.pk, place.pk, place.normalized_name)
+        if dictionary is not None:
+            dictionary.add_key(place.normalized_name, place.pk)
+    _names_changed(city_id)
+
+
+@receiver(post_delete, sender=Place)
+def unindex_place(sender, instance, **kwargs):
+    index = search.loaded_index(instance.city_id)
+    if index is not None:
+        index.remove("place", instance.pk)
+    matching.drop_place_dictionary(instance.city_id)
+    search_cache.forget_place_city(instance.pk)
+    _names_changed(instance.city_id)
+
+
+@receiver(post_save, sender=PlaceAlias)
+def index_alias(sender, instance, **kwargs):
+    city_id = instance.city_id
+    for index in search.loaded_indexes():
+        if index.city_id != city_id:
+            index.remove("alias", instance.pk)
+    index = search.loaded_index(city_id)
+    if index is not None:
+        index.add("alias", instance.pk, instance.place_id, instance.normalized_name)
+
+    dictionary = matching.loaded_dictionary(city_id)
+    if kwargs.get("created") and dictionary is not None:
+        dictionary.add_key(instance.normalized_name, instance.place_id)
+    elif not kwargs.get("created"):
+        matching.drop_place_dictionary()
+    _names_changed(city_id)
+
+
+@receiver(post_delete, sender=PlaceAlias)
+def unindex_alias(sender, instance, **kwargs):
+    for index in search.loaded_indexes():
+        index.remove("alias", instance.pk)
+    matching.drop_place_dictionary()
+    _names_changed(instance.city_id)
+
+
+@receiver(post_migrate)
+def restore_sqlite_fts(sender, using="default", **kwargs):
+    if sender.name == "app":
+        search.ensure_sqlite_fts(using)
+
+
+# Place.route_count (incoming + outgoing routes, for autocomplete ranking) and the
+# PlaceConnection adjacency (destination -> starting places, for starting-place search)
+# are both derived from Route.destination + Route.starting_places and kept current here.
+
+def _bump_route_count(place_ids, delta):
+    counts = Counter(place_ids)
+    if not counts:
+        return
+    # one UPDATE for every place; never go below zero if counts drifted, refresh_place_popularity fixes drift
+    change = Case(*(When(pk=place_id, then=Value(delta * times)) for place_id, times in counts.items()))
+    Place.objects.filter(pk__in=counts).update(route_count=Greatest(F("route_count") + change, Value(0)))
+    # every route write passes through here; popularity and connections feed search results
+    for city_id in set(Place.objects.filter(pk__in=counts).values_list("city_id", flat=True)):
+        search_cache.bump_generation(city_id, search_cache.ROUTES)
+
+
+def _bump_connections(pairs, delta):
+    """pairs: (destination_id, starting_place_id) for each route link added or removed."""
+    counts = Counter(pairs)
+    if not counts:
+        return
+    links = PlaceConnection.objects.filter(reduce(operator.or_, (
+        Q(destination_id=destination_id, starting_place_id=starting_place_id)
+        for destination_id, starting_place_id in counts
+    )))
+    change = Case(*(
+        When(destination_id=destination_id, starting_place_id=starting_place_id, then=Value(delta * times))
+        for (destination_id, starting_place_id), times in counts.items()
+    ))
+    if delta > 0:
+        # missing links start at zero (one INSERT, existing ones skipped), then one UPDATE moves them all
+        PlaceConnection.objects.bulk_create(
+            [PlaceConnection(destination_id=destination_id, starting_place_id=starting_place_id, route_count=0)
+             for destination_id, starting_place_id in counts],
+            ignore_conflicts=True,
+        )
+        links.update(route_count=F("route_count") + change)
+    else:
+        links.update(route_count=Greatest(F("route_count") + change, Value(0)))
+        links.filter(route_count=0).delete()
+
+
+def _link(pairs, delta):
+    _bump_route_count([starting_place_id for _, starting_place_id in pairs], delta)
+    _bump_connections(pairs, delta)
+
+
+@receiver(pre_save, sender=Route)
+def remember_route_destination(sender, instance, **kwargs):
+    instance._previous_destination_id = None
+    if instance.pk and not instance._state.adding:
+        instance._previous_destination_id = (
+            Route.objects.filter(pk=instance.pk).values_list("destination_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Route)
+def count_route_destination(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_destination_id", None)
+    if created:
+        _bump_route_count([instance.destination_id], 1)
+    elif previous is not None and previous != instance.destination_id:
+        _bump_route_count([previous], -1)
+        _bump_route_count([instance.destination_id], 1)
+        starting = list(instance.starting_places.values_list("id", flat=True))
+        _bump_connections([(previous, place_id) for place_id in starting], -1)
+        _bump_connections([(instance.destination_id, place_id) for place_id in starting], 1)
+
+
+@receiver(pre_delete, sender=Route)
+def uncount_route(sender, instance, **kwargs):
+    # the through rows are cascaded without m2m_changed, so count them down here
+    starting = list(instance.starting_places.values_list("id", flat=True))
+    _bump_route_count([instance.destination_id], -1)
+    _link([(instance.destination_id, place_id) for place_id in starting], -1)
+
+
+@receiver(m2m_changed, sender=Route.starting_places.through)
+def count_starting_places(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        if reverse:
+            # place.outgoing_routes.clear()
+            destinations = instance.outgoing_routes.values_list("destination_id", flat=True)
+            instance._cleared_links = [(destination_id, instance.pk) for destination_id in destinations]
+        else:
+            starting = instance.starting_places.values_list("id", flat=True)
+            instance._cleared_links = [(instance.destination_id, place_id) for place_id in starting]
+        return
+    if action == "post_clear":
+        _link(getattr(instance, "_cleared_links", []), -1)
+        return
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    delta = 1 if action == "post_add" else -1
+    if reverse:
+        # place.outgoing_routes.add(route, ...): pk_set holds route ids
+        destinations = Route.objects.filter(pk__in=pk_set).values_list("destination_id", flat=True)
+        _link([(destination_id, instance.pk) for destination_id in destinations], delta)
+    else:
+        _link([(instance.destination_id, place_id) for place_id in pk_set], delta)
+
+
+def routes_bulk_created(routes, links, linked_route_ids=()):
+    """
+    What the Route, RouteStep and starting_places signals do, for rows made with
+    bulk_create (which sends none): new `routes`, plus starting_places rows (`links`,
+    as (destination_id, starting_place_id)) added to them and to the existing routes
+    `linked_route_ids`.
+    """
+    # one count update for the new destinations and the linked starting places together
+    _bump_route_count([route.destination_id for route in routes] + [place_id for _, place_id in links], 1)
+    _bump_connections(links, 1)
+    route_cache.touch_routes(linked_route_ids)
+    planner.routes_changed([route.pk for route in routes] + list(linked_route_ids))
+
+
+@receiver(post_save, sender=StepFare)
+def record_fare(sender, instance, created, **kwargs):
+    if created:
+        _fare_changed(*fares.record_fare(instance))
+
+
+@receiver(post_delete, sender=StepFare)
+def unrecord_fare(sender, instance, **kwargs):
+    _fare_changed(*fares.record_fare(instance, removed=True))
+
+
+def _fare_changed(route_id, band_changed):
+    # the sample size is in the route document, but the planner only costs steps by their
+    # band: a report that leaves it alone mustn't make every worker rebuild the graph
+    route_cache.touch_routes([route_id])
+    if band_changed:
+        planner.routes_changed([route_id])
+
+
+def _route_content_changed(route_ids):
+    # fares and steps feed both the route documents and the planner's edge costs
+    route_cache.touch_routes(route_ids)
+    planner.routes_changed(route_ids)
+
+
+# Cached route documents (app/route_cache.py) are keyed by Route.updated_at: the route's
+# own saves move it, changes below the route move it through touch_routes.
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def retire_route_document(sender, instance, **kwargs):
+    # the city the route was in before this write, in case it left it
+    previous = getattr(instance, "_previous_destination_id", None) or instance.destination_id
+    planner.routes_changed([instance.pk], [search_cache.place_city_id(previous)])
+
+
+@receiver(post_save, sender=RouteStep)
+@receiver(post_delete, sender=RouteStep)
+def retire_step_route_document(sender, instance, **kwargs):
+    _route_content_changed([instance.route_id])
+
+
+def _refresh_fingerprints(route_ids):
+    steps = defaultdict(list)
+    rows = RouteStep.objects.filter(route_id__in=route_ids).order_by("route_id", "order")
+    for route_id, mode, drop_name, landmark in rows.values_list("route_id", "mode", "drop_name", "landmark"):
+        steps[route_id].append((mode, drop_name, landmark))
+    for route_id in route_ids:
+        Route.objects.filter(pk=route_id).update(fingerprint=route_fingerprint(steps[route_id]))
+
+
+@receiver(post_save, sender=RouteStep)
+@receiver(post_delete, sender=RouteStep)
+def refresh_route_fingerprint(sender, instance, **kwargs):
+    _refresh_fingerprints([instance.route_id])
+
+
+@receiver(m2m_changed, sender=Route.starting_places.through)
+def retire_linked_route_documents(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        route_cache.touch_routes([instance.pk])
+        planner.routes_changed([instance.pk])
+    elif action == "post_clear":
+        # the links are already gone; a cleared place's old routes carry its name until they change
+        planner.drop_route_graph(instance.city_id)
+        search_cache.bump_generation(instance.city_id, planner.GRAPH)
+    else:
+        route_cache.touch_routes(pk_set or ())
+        planner.routes_changed(pk_set or ())
+
+
+@receiver(post_save, sender=Place)
+def retire_place_route_documents(sender, instance, created, **kwargs):
+    if created:
+        return
+    route_ids = set(instance.incoming_routes.values_list("id", flat=True))
+    route_ids.update(instance.outgoing_routes.values_list("id", flat=True))
+    route_cache.touch_routes(route_ids)
+
+
+# Offline bundles (app/bundles.py) sync on updated_at: aliases ride on their place's, and
+# places and routes leaving a city leave a tombstone behind for delta clients.
+
+def _city_deleted(origin):
+    # the whole city is going: its tombstones go with it, nobody is left to sync
+    return getattr(origin, "model", type(origin)) is City
+
+
+@receiver(post_save, sender=PlaceAlias)
+@receiver(post_delete, sender=PlaceAlias)
+def touch_alias_place(sender, instance, **kwargs):
+    Place.objects.filter(pk=instance.place_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Place)
+def bury_place(sender, instance, origin=None, **kwargs):
+    if not _city_deleted(origin):
+        bundles.bury(instance.city_id, BundleTombstone.PLACE, [instance.pk])
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def bury_route(sender, instance, origin=None, **kwargs):
+    if kwargs.get("signal") is post_delete:
+        if not _city_deleted(origin):
+            bundles.bury(search_cache.place_city_id(instance.destination_id), BundleTombstone.ROUTE, [instance.pk])
+        return
+    previous = getattr(instance, "_previous_destination_id", None)
+    if previous is not None and previous != instance.destination_id:
+        previous_city = search_cache.place_city_id(previous)
+        if previous_city != search_cache.place_city_id(instance.destination_id):
+            bundles.bury(previous_city, BundleTombstone.ROUTE, [instance.pk])
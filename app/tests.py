@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import base64
+import gzip
+import io
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from rest_framework.renderers import JSONRenderer
+
+from main.models import User
+
+from . import moderation
+from .cities import get_city_id
+from .fares import FareSketch
+from .jobs import claim_jobs, enqueue_approval, process_jobs
+from .matching import PlaceDictionary, drop_place_dictionary, edit_distance, get_place_dictionary
+from .models import ApprovalJob, City, FareEstimate, IdempotencyKey, Place, PlaceAlias, PlaceConnection, Route, RouteStep, RouteStepSubmission, RouteSubmission, StepFare
+from .names import normalize_name
+from .planner import GRAPH, drop_route_graph
+from .renderers import FastJSONRenderer
+from .resolver import PlaceResolver, place_resolver
+from .route_cache import with_route_details
+from .search import MemorySearchBackend, drop_place_index, get_place_index
+from .search_cache import get_generation
+from .serializers import RouteSerializer, read_routes
+
+# Queries rendering route documents may cost, whatever the number of routes/steps/fares:
+# routes + destination, steps + fare estimates, starting places
+ROUTE_QUERY_BUDGET = 3
+# RouteLookupView first finds the matching route ids, RouteView reads updated_at for its validators
+LOOKUP_QUERIES = 1
+DETAIL_QUERIES = 1
+
+
+class RouteTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # as if committed: generation bumps wait for the commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.city = City.objects.create(name="Abuja, NG")
+            cls.destination = Place.objects.create(city=cls.city, canonical_name="Wuse Market")
+            cls.start = Place.objects.create(city=cls.city, canonical_name="Kubwa")
+            cls.other_start = Place.objects.create(city=cls.city, canonical_name="Garki")
+
+    def setUp(self):
+        # throttle counters and route documents live in the cache
+        cache.clear()
+        # the per-worker structures outlive the rolled-back rows (and generations) they were built from
+        drop_route_graph()
+        drop_place_index()
+        drop_place_dictionary()
+        self.client = APIClient()
+
+    def add_routes(self, count, steps=4, fares=5):
+        routes = []
+        for _ in range(count):
+            route = Route.objects.create(destination=self.destination)
+            route.starting_places.add(self.start, self.other_start)
+            for order in range(1, steps + 1):
+                step = RouteStep.objects.create(route=route, order=order, mode=RouteStep.BUS, instruction="Board")
+                for amount in range(fares):
+                    StepFare.objects.create(route_step=step, amount=200 + amount * 50)
+            routes.append(route)
+        return routes
+
+    def lookup(self):
+        return self.client.get(
+            "/api/v1/routes/lookup/",
+            {"destination": self.destination.pk, "start": self.start.pk},
+        )
+
+
+
+class RouteQueryBudgetTests(RouteTestCase):
+    """Fails when a serializer change brings back per-route or per-step queries."""
+
+    def test_route_detail(self):
+        route = self.add_routes(1, steps=8)[0]
+        with self.assertNumQueries(DETAIL_QUERIES + ROUTE_QUERY_BUDGET):
+            response = self.client.get(f"/api/v1/routes/{route.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["steps"]), 8)
+        self.assertIsNotNone(response.json()["steps"][0]["estimated_fare"])
+
+        with self.assertNumQueries(DETAIL_QUERIES):
+            cached = self.client.get(f"/api/v1/routes/{route.pk}/")
+        self.assertEqual(cached.content, response.content)
+
+    def test_route_lookup(self):
+        self.add_routes(2)
+        with self.assertNumQueries(LOOKUP_QUERIES + ROUTE_QUERY_BUDGET):
+            response = self.lookup()
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        with self.assertNumQueries(LOOKUP_QUERIES):
+            self.lookup()
+
+    def test_route_lookup_does_not_grow_with_routes(self):
+        self.add_routes(10, steps=6)
+        with self.assertNumQueries(LOOKUP_QUERIES + ROUTE_QUERY_BUDGET):
+            response = self.lookup()
+        self.assertEqual(len(response.json()["results"]), 10)
+
+    def test_batch_route_lookup(self):
+        self.add_routes(3)
+        elsewhere = Place.objects.create(city=self.city, canonical_name="Maitama")
+        other = Route.objects.create(destination=elsewhere)
+        other.starting_places.add(self.other_start)
+        pairs = [
+            {"start": self.start.pk, "destination": self.destination.pk},
+            {"start": self.other_start.pk, "destination": elsewhere.pk},
+            # crosses the two above: must come back empty
+            {"start": self.start.pk, "destination": elsewhere.pk},
+        ]
+        with self.assertNumQueries(LOOKUP_QUERIES + ROUTE_QUERY_BUDGET):
+            response = self.client.post("/api/v1/routes/lookup/batch/", {"pairs": pairs}, format="json")
+        results = response.json()["results"]
+        self.assertEqual([len(result["routes"]) for result in results], [3, 1, 0])
+        self.assertEqual(results[1]["routes"][0]["id"], other.pk)
+
+    def test_route_lookup_without_routes(self):
+        with self.assertNumQueries(LOOKUP_QUERIES):
+            response = self.lookup()
+        self.assertEqual(response.json()["results"], [])
+
+
+
+class ConditionalGetTests(RouteTestCase):
+    """ETag / Last-Modified on the route and search endpoints."""
+
+    def test_route_detail_not_modified(self):
+        route = self.add_routes(1)[0]
+        response = self.client.get(f"/api/v1/routes/{route.pk}/")
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(DETAIL_QUERIES):
+            again = self.client.get(f"/api/v1/routes/{route.pk}/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], response["ETag"])
+
+    def test_route_detail_changes_with_fares(self):
+        route = self.add_routes(1)[0]
+        etag = self.client.get(f"/api/v1/routes/{route.pk}/")["ETag"]
+        StepFare.objects.create(route_step=route.steps.first(), amount=900)
+
+        response = self.client.get(f"/api/v1/routes/{route.pk}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_route_lookup_changes_with_place_rename(self):
+        self.add_routes(2)
+        etag = self.lookup()["ETag"]
+        self.assertEqual(self.client.get(
+            "/api/v1/routes/lookup/",
+            {"destination": self.destination.pk, "start": self.start.pk},
+            HTTP_IF_NONE_MATCH=etag,
+        ).status_code, 304)
+
+        self.start.canonical_name = "Kubwa Village"
+        self.start.save()
+        response = self.client.get(
+            "/api/v1/routes/lookup/",
+            {"destination": self.destination.pk, "start": self.start.pk},
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Kubwa Village")
+
+    def test_search_not_modified_until_places_change(self):
+        url = "/api/v1/search/destinations/"
+        etag = self.client.get(url, {"q": "wuse"})["ETag"]
+        # the city's generations
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"q": "Wuse"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # the generation moves once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Place.objects.create(city=self.city, canonical_name="Wuse 2")
+        response = self.client.get(url, {"q": "wuse"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class OtherWorkerTests(RouteTestCase):
+    """Writes made by a worker with its own cache still retire what this worker has cached."""
+
+    def other_worker(self):
+        return self.settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-worker"}})
+
+    def test_route_documents(self):
+        route = self.add_routes(1, steps=1, fares=0)[0]
+        self.assertContains(self.client.get(f"/api/v1/routes/{route.pk}/"), '"Board"')
+        with self.other_worker():
+            RouteStep.objects.filter(route=route).get().delete()
+            RouteStep.objects.create(route=route, order=1, mode=RouteStep.BUS, instruction="Board at Kubwa")
+        self.assertContains(self.client.get(f"/api/v1/routes/{route.pk}/"), "Board at Kubwa")
+        self.assertContains(self.lookup(), "Board at Kubwa")
+
+    def test_search_results(self):
+        url = "/api/v1/search/destinations/"
+        self.assertEqual(len(self.client.get(url, {"q": "wuse"}).json()["results"]), 1)
+        with self.other_worker(), self.captureOnCommitCallbacks(execute=True):
+            Place.objects.create(city=self.city, canonical_name="Wuse 2")
+        self.assertEqual(len(self.client.get(url, {"q": "wuse"}).json()["results"]), 2)
+
+    def test_generations_move_once_after_commit(self):
+        before = get_generation(self.city.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Place.objects.create(city=self.city, canonical_name="Jabi Lake")
+            PlaceAlias.objects.create(place=self.start, name="Kubwa Village")
+            # no lock on the City row while the write is open
+            self.assertEqual(get_generation(self.city.pk), before)
+        self.assertEqual(get_generation(self.city.pk), before + 1)
+
+
+class RoutePlanTests(RouteTestCase):
+    def route(self, start, destination, mode=RouteStep.BUS, steps=1):
+        route = Route.objects.create(destination=destination)
+        route.starting_places.add(start)
+        for order in range(1, steps + 1):
+            RouteStep.objects.create(route=route, order=order, mode=mode, instruction="Board")
+        return route
+
+    def plan(self, start, destination, **params):
+        return self.client.get("/api/v1/routes/plan/", {"start": start.pk, "destination": destination.pk, **params})
+
+    def itineraries(self, response):
+        return [[leg["route"]["id"] for leg in itinerary["legs"]] for itinerary in response.json()["itineraries"]]
+
+    def test_multi_leg_itineraries(self):
+        to_garki = self.route(self.start, self.other_start)
+        to_wuse = self.route(self.other_start, self.destination)
+        direct = self.route(self.start, self.destination, mode=RouteStep.CAB, steps=3)
+
+        response = self.plan(self.start, self.destination)
+        # cheapest first, then the one with fewer legs
+        self.assertEqual(self.itineraries(response), [[to_garki.pk, to_wuse.pk], [direct.pk]])
+        legs = response.json()["itineraries"][0]["legs"]
+        self.assertEqual([(leg["from"], leg["to"]) for leg in legs], [(self.start.pk, self.other_start.pk), (self.other_start.pk, self.destination.pk)])
+        self.assertEqual(self.itineraries(self.plan(self.start, self.destination, max_hops=1)), [[direct.pk]])
+
+    def test_graph_follows_route_writes(self):
+        self.assertEqual(self.itineraries(self.plan(self.start, self.destination)), [])
+        route = self.route(self.start, self.destination)
+        self.assertEqual(self.itineraries(self.plan(self.start, self.destination)), [[route.pk]])
+        route.delete()
+        self.assertEqual(self.itineraries(self.plan(self.start, self.destination)), [])
+
+    def test_fare_reports_move_the_graph_only_when_the_band_does(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            step = self.route(self.start, self.destination).steps.get()
+
+        def report(amount):
+            before = get_generation(self.city.pk, GRAPH)
+            with self.captureOnCommitCallbacks(execute=True):
+                StepFare.objects.create(route_step=step, amount=amount)
+            return get_generation(self.city.pk, GRAPH) != before
+
+        # below MIN_FARE_SAMPLES there is no band yet, then the third report sets one
+        self.assertEqual([report(500), report(500), report(500)], [False, False, True])
+        self.assertFalse(report(500))
+        self.assertTrue(report(5000))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.plan(self.start, self.start).status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/routes/plan/", {"start": self.start.pk}).status_code, 400)
+        other_city = Place.objects.create(city=City.objects.create(name="Lagos, NG"), canonical_name="Yaba")
+        self.assertEqual(self.plan(self.start, other_city).status_code, 400)
+
+
+class PlaceMatchingTests(RouteTestCase):
+    def dictionary(self):
+        return PlaceDictionary(self.city.pk).build()
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("kitten", "sitting"), 3)
+        self.assertEqual(edit_distance("wuse", "wuse"), 0)
+        # gives up at limit + 1, on length alone or once every row is past it
+        self.assertEqual(edit_distance("abc", "abcdef", limit=2), 3)
+        self.assertEqual(edit_distance("abc", "xyz", limit=1), 2)
+
+    def test_near_misses_within_the_threshold(self):
+        dictionary = self.dictionary()
+        place_id, confidence = dictionary.match("Wuse Markt")
+        self.assertEqual(place_id, self.destination.pk)
+        self.assertAlmostEqual(confidence, 1 - 1 / 11)
+        self.assertEqual(dictionary.match("wuse  MARKET"), (self.destination.pk, 1.0))
+        # one edit in six characters scores 0.83
+        self.assertIsNone(dictionary.match("Kubwaa"))
+        self.assertEqual(dictionary.match("Kubwaa", threshold=0.8)[0], self.start.pk)
+        # too short for even one edit at 0.85
+        self.assertIsNone(dictionary.match("Garky"))
+        self.assertIsNone(dictionary.match("  "))
+
+    def test_numbers_must_match(self):
+        phase_1 = Place.objects.create(city=self.city, canonical_name="Gwarinpa Phase 1")
+        dictionary = self.dictionary()
+        self.assertEqual(dictionary.match("Gwarimpa Phase 1")[0], phase_1.pk)
+        self.assertIsNone(dictionary.match("Gwarimpa Phase 2"))
+
+    def test_canonical_names_win_over_aliases(self):
+        old_market = Place.objects.create(city=self.city, canonical_name="Old Market")
+        PlaceAlias.objects.create(place=self.other_start, name="Old Market")
+        # a shared alias goes to the oldest place, whichever alias came first
+        PlaceAlias.objects.create(place=self.other_start, name="Tipper Garage")
+        PlaceAlias.objects.create(place=self.start, name="Tipper Garage")
+        dictionary = self.dictionary()
+        self.assertEqual(dictionary.match("old market"), (old_market.pk, 1.0))
+        self.assertEqual(dictionary.match("Tipper Garage"), (self.start.pk, 1.0))
+
+
+class PlaceResolverTests(RouteTestCase):
+    def unsignalled_place(self, name):
+        # written by "another worker": bulk_create sends no signals, so this worker's dictionary lags
+        return Place.objects.bulk_create([Place(city=self.city, canonical_name=name, normalized_name=normalize_name(name))])[0]
+
+    def test_resolves_known_names_and_creates_the_rest(self):
+        resolved = place_resolver.resolve_many(self.city, ["Wuse Markt", "Jabi Lake", "jabi  lake", " "], area="Jabi")
+        self.assertEqual(set(resolved), {"Wuse Markt", "Jabi Lake", "jabi  lake"})
+        self.assertEqual(resolved["Wuse Markt"], self.destination)
+        # two spellings of one new place share the row
+        self.assertEqual(resolved["Jabi Lake"], resolved["jabi  lake"])
+        self.assertEqual((resolved["Jabi Lake"].canonical_name, resolved["Jabi Lake"].area), ("Jabi Lake", "Jabi"))
+        self.assertEqual(place_resolver.resolve_many(self.city, ["Lokogoma"], create=False), {})
+
+    def test_names_without_letters_or_digits_name_no_place(self):
+        resolved = place_resolver.resolve_many(self.city, ["!!!", "???", "Jabi Lake"])
+        self.assertEqual(list(resolved), ["Jabi Lake"])
+        self.assertIsNone(place_resolver.resolve(self.city, "---"))
+        self.assertFalse(Place.objects.filter(normalized_name="").exists())
+
+    def test_names_the_dictionary_lags_on_are_found_in_the_columns(self):
+        get_place_dictionary(self.city.pk)
+        life_camp = self.unsignalled_place("Life Camp")
+        PlaceAlias.objects.bulk_create([PlaceAlias(place=self.start, city=self.city, name="Kubwa Village", normalized_name="kubwa village")])
+        resolved = place_resolver.resolve_many(self.city, ["life camp", "Kubwa Village"], fuzzy=False)
+        self.assertEqual(resolved, {"life camp": life_camp, "Kubwa Village": self.start})
+        self.assertEqual(Place.objects.count(), 4)
+
+    def test_places_deleted_elsewhere_reload_the_dictionary(self):
+        jabi = Place.objects.create(city=self.city, canonical_name="Jabi Lake")
+        PlaceAlias.objects.create(place=self.other_start, name="Jabi Lake")
+        get_place_dictionary(self.city.pk)
+        Place.objects.filter(pk=jabi.pk)._raw_delete(Place.objects.db)
+        # the reloaded dictionary sends the near miss to the alias left behind
+        self.assertEqual(place_resolver.resolve_many(self.city, ["Jabi Lakes"], create=False), {"Jabi Lakes": self.other_start})
+
+    def test_create_race_returns_the_winner(self):
+        get_place_dictionary(self.city.pk)
+        winner = self.unsignalled_place("Life Camp")
+        # the other request committed after this one looked
+        with mock.patch.object(PlaceResolver, "_lookup", return_value={}):
+            resolved = place_resolver.resolve(self.city, "life  camp", fuzzy=False)
+        self.assertEqual(resolved, winner)
+        self.assertEqual(Place.objects.filter(normalized_name="life camp").count(), 1)
+
+
+class AutocompleteTests(RouteTestCase):
+    url = "/api/v1/search/autocomplete/"
+
+    def places(self, *names):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [Place.objects.create(city=self.city, canonical_name=name) for name in names]
+
+    def names(self, **params):
+        return [row["canonical_name"] for row in self.client.get(self.url, params).json()]
+
+    def test_exact_then_prefix_then_substring_then_alias(self):
+        market, square, road, old = self.places("Market", "Market Square", "Market Rd", "Old Market")
+        with self.captureOnCommitCallbacks(execute=True):
+            PlaceAlias.objects.create(place=self.start, name="Market Gate")
+        Place.objects.filter(pk=road.pk).update(route_count=5)
+        Place.objects.filter(pk=self.destination.pk).update(route_count=2)
+        self.assertEqual(self.names(q="market"), [
+            "Market",
+            # prefixes: the busier place first
+            "Market Rd", "Market Square",
+            "Wuse Market", "Old Market",
+            # only the alias matches
+            "Kubwa",
+        ])
+
+    def test_route_count_ties_break_on_name(self):
+        self.places("Jabi Park", "Jabi Lake", "Jabi Mall")
+        self.assertEqual(self.names(q="jabi"), ["Jabi Lake", "Jabi Mall", "Jabi Park"])
+
+    def test_limit_is_capped(self):
+        self.places(*(f"Stall {number:02}" for number in range(25)))
+        self.assertEqual(len(self.names(q="stall")), 10)
+        self.assertEqual(len(self.names(q="stall", limit=50)), 20)
+        self.assertEqual(len(self.names(q="stall", limit=0)), 1)
+        self.assertEqual(len(self.names(q="stall", limit="lots")), 10)
+
+
+class StartingPlaceTests(RouteTestCase):
+    def connections(self):
+        return dict(
+            ((destination, start), count)
+            for destination, start, count in PlaceConnection.objects.values_list("destination_id", "starting_place_id", "route_count")
+        )
+
+    def route(self, *starts):
+        with self.captureOnCommitCallbacks(execute=True):
+            route = Route.objects.create(destination=self.destination)
+            route.starting_places.add(*starts)
+        return route
+
+    def test_connections_follow_route_links(self):
+        first = self.route(self.start, self.other_start)
+        second = self.route(self.start)
+        self.assertEqual(self.connections(), {(self.destination.pk, self.start.pk): 2, (self.destination.pk, self.other_start.pk): 1})
+
+        first.starting_places.remove(self.other_start)
+        self.assertEqual(self.connections(), {(self.destination.pk, self.start.pk): 2})
+        second.starting_places.clear()
+        self.assertEqual(self.connections(), {(self.destination.pk, self.start.pk): 1})
+        # from the place's side of the relation
+        self.other_start.outgoing_routes.add(second)
+        self.assertEqual(self.connections(), {(self.destination.pk, self.start.pk): 1, (self.destination.pk, self.other_start.pk): 1})
+        first.delete()
+        second.delete()
+        self.assertEqual(self.connections(), {})
+
+    def test_rebuild_recounts_from_the_routes(self):
+        self.route(self.start, self.other_start)
+        route = self.route(self.start)
+        expected = self.connections()
+        # links written without signals, and a count gone stale
+        Route.starting_places.through.objects.bulk_create([Route.starting_places.through(route=route, place=self.other_start)])
+        PlaceConnection.objects.filter(starting_place=self.start).update(route_count=7)
+        call_command("rebuild_place_connections", stdout=io.StringIO())
+        self.assertEqual(self.connections(), {**expected, (self.destination.pk, self.other_start.pk): 2})
+
+    def test_search_orders_by_connections(self):
+        url = f"/api/v1/search/destinations/{self.destination.pk}/starting-places/"
+        self.route(self.start)
+        self.route(self.start, self.other_start)
+        names = lambda **params: [row["canonical_name"] for row in self.client.get(url, params).json()["results"]]
+        self.assertEqual(names(), ["Kubwa", "Garki"])
+        self.assertEqual(names(q="garki"), ["Garki"])
+
+        # a place with no routes left drops out
+        with self.captureOnCommitCallbacks(execute=True):
+            Route.objects.filter(starting_places=self.other_start).get().starting_places.remove(self.other_start)
+        self.assertEqual(names(), ["Kubwa"])
+
+
+class PlaceIndexTests(RouteTestCase):
+    """This worker's trigram index follows its own writes in place and rebuilds for other workers'."""
+
+    def test_follows_renames_aliases_and_deletes(self):
+        index = get_place_index(self.city.pk)
+        self.assertEqual(index.search("wuse"), {self.destination.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.destination.canonical_name = "Jabi Market"
+            self.destination.save()
+            alias = PlaceAlias.objects.create(place=self.start, name="Kubwa Village")
+        # patched, not rebuilt
+        self.assertIs(get_place_index(self.city.pk), index)
+        self.assertEqual(index.search("wuse"), set())
+        self.assertEqual(index.search("jabi mkt"), {self.destination.pk})
+        self.assertEqual(index.search("village"), {self.start.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alias.delete()
+            self.destination.delete()
+        self.assertIs(get_place_index(self.city.pk), index)
+        self.assertEqual(index.search("village") | index.search("jabi"), set())
+
+    def test_rebuilds_when_another_worker_moved_the_generation(self):
+        index = get_place_index(self.city.pk)
+        # written elsewhere: no signals here, only the committed generation bump
+        life_camp = Place.objects.bulk_create([Place(city=self.city, canonical_name="Life Camp", normalized_name="life camp")])[0]
+        self.assertEqual(get_place_index(self.city.pk).search("life"), set())
+        City.objects.filter(pk=self.city.pk).update(names_generation=F("names_generation") + 1)
+
+        rebuilt = get_place_index(self.city.pk)
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.generation, get_generation(self.city.pk))
+        self.assertEqual(rebuilt.search("life"), {life_camp.pk})
+
+    def test_memory_backend_filters_by_the_index(self):
+        backend = MemorySearchBackend()
+        places = Place.objects.filter(city=self.city)
+        self.assertEqual(list(backend.filter(places, "market", self.city.pk)), [self.destination])
+        # without a city it reads the cities off the queryset
+        self.assertEqual(set(backend.filter(places, "u")), {self.destination, self.start})
+
+
+class CityIsolationTests(RouteTestCase):
+    """Every lookup stays inside one city, and inactive cities are not served."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lagos = City.objects.create(name="Lagos, NG")
+            self.lagos_market = Place.objects.create(city=self.lagos, canonical_name="Wuse Market")
+            self.yaba = Place.objects.create(city=self.lagos, canonical_name="Yaba")
+
+    def ids(self, url, city, **params):
+        response = self.client.get(url, {"city": city, **params})
+        rows = response.json()
+        return [row["id"] for row in (rows["results"] if isinstance(rows, dict) else rows)]
+
+    def test_search_and_autocomplete(self):
+        for url in ("/api/v1/search/destinations/", "/api/v1/search/autocomplete/"):
+            self.assertEqual(self.ids(url, "Abuja, NG", q="market"), [self.destination.pk])
+            self.assertEqual(self.ids(url, "lagos ng", q="market"), [self.lagos_market.pk])
+            self.assertEqual(self.ids(url, self.lagos.pk, q="kubwa"), [])
+
+    def test_resolver(self):
+        self.assertEqual(place_resolver.resolve(self.lagos, "Wuse Markt"), self.lagos_market)
+        self.assertEqual(place_resolver.resolve(self.city, "wuse market"), self.destination)
+        self.assertIsNone(place_resolver.resolve(self.lagos, "Kubwa", create=False))
+        self.assertIsNone(place_resolver.resolve(self.city, "Yaba", create=False))
+        # created in the city asked for, next to the other city's place of the same name
+        created = place_resolver.resolve(self.lagos, "Garki")
+        self.assertEqual((created.city_id, Place.objects.filter(normalized_name="garki").count()), (self.lagos.pk, 2))
+
+    def test_inactive_city_is_not_served(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lagos.is_active = False
+            self.lagos.save()
+        for url in ("/api/v1/search/destinations/", "/api/v1/search/autocomplete/"):
+            self.assertEqual(self.client.get(url, {"city": "Lagos, NG", "q": "market"}).status_code, 404)
+        self.assertEqual(self.client.get(f"/api/v1/cities/{self.lagos.pk}/bundle/").status_code, 404)
+        self.assertEqual(self.ids("/api/v1/search/autocomplete/", "Abuja, NG", q="market"), [self.destination.pk])
+
+
+class FareEstimateTests(RouteTestCase):
+    def estimates(self):
+        return sorted(FareEstimate.objects.values_list("route_step_id", "min_amount", "max_amount", "sample_size"))
+
+    def test_replay_matches_the_running_estimates(self):
+        steps = [step for route in self.add_routes(2, steps=2, fares=0) for step in route.steps.order_by("id")]
+        start = timezone.now() - timedelta(days=120)
+        fares = []
+        # reports spread over months, so the decay weighs in, and fares go up over time
+        for day in range(0, 120, 6):
+            with mock.patch("django.utils.timezone.now", return_value=start + timedelta(days=day)):
+                for position, step in enumerate(steps[:3]):
+                    fares.append(StepFare.objects.create(route_step=step, amount=200 + day * 5 + position * 30))
+        StepFare.objects.create(route_step=steps[3], amount=400)
+        # taken back out: a middle report, and enough of one step to leave it without a band
+        fares[10].delete()
+        for fare in StepFare.objects.filter(route_step=steps[2]).order_by("id")[2:]:
+            fare.delete()
+
+        running = self.estimates()
+        self.assertEqual([row[1] is None for row in running], [False, False, True, True])
+        call_command("rebuild_fare_estimates", stdout=io.StringIO())
+        self.assertEqual(self.estimates(), running)
+
+
+class SearchCacheStatsTests(RouteTestCase):
+    def test_counts_hits_misses_and_writes_per_endpoint(self):
+        for _ in range(3):
+            self.client.get("/api/v1/search/autocomplete/", {"q": "wuse"})
+        self.client.get("/api/v1/search/destinations/", {"q": "market"})
+
+        url = "/api/v1/search/cache-stats/"
+        self.client.force_authenticate(User.objects.create_user("rider"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        stats = self.client.get(url).json()
+        self.assertEqual(stats["autocomplete"], {"hits": 2, "misses": 1, "entries_written_total": 1, "hit_ratio": 0.6667})
+        self.assertEqual(stats["destinations"], {"hits": 0, "misses": 1, "entries_written_total": 1, "hit_ratio": 0.0})
+        self.assertEqual(stats["starting-places"], {"hits": 0, "misses": 0, "entries_written_total": 0, "hit_ratio": None})
+
+
+class FastPathTests(RouteTestCase):
+    """The .values() readers and FastJSONRenderer must produce the serializers' exact bytes."""
+
+    def test_read_routes_matches_route_serializer(self):
+        routes = self.add_routes(3, steps=3, fares=2)
+        StepFare.objects.create(route_step=routes[0].steps.first(), amount=1000)
+        RouteStep.objects.create(route=routes[1], order=9, mode=RouteStep.WALK, instruction="Walk \u2028 \u00e9")
+        route_ids = [route.pk for route in routes]
+
+        stock = RouteSerializer(with_route_details(Route.objects.filter(pk__in=route_ids).order_by("id")), many=True).data
+        data = read_routes(route_ids)
+        fast = [data[route_id] for route_id in route_ids]
+        self.assertEqual(JSONRenderer().render(stock), JSONRenderer().render(fast))
+        self.assertEqual(JSONRenderer().render(stock), FastJSONRenderer().render(fast))
+
+    def test_search_rows_match_serializer(self):
+        response = self.client.get("/api/v1/search/autocomplete/", {"q": "wuse"})
+        self.assertEqual(response.json(), [{"id": self.destination.pk, "canonical_name": "Wuse Market", "area": ""}])
+        response = self.client.get("/api/v1/search/destinations/", {"q": "market"})
+        self.assertEqual(response.json()["results"], [{"id": self.destination.pk, "canonical_name": "Wuse Market"}])
+        # no query, no rows (and no rank to read)
+        self.assertEqual(self.client.get("/api/v1/search/destinations/").json(), {"next": None, "results": []})
+
+
+class CityBundleTests(RouteTestCase):
+    """Offline bundles: the snapshot holds the city, a delta only what changed since its version."""
+
+    def bundle(self, **params):
+        response = self.client.get(f"/api/v1/cities/{self.city.pk}/bundle/", params, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        return json.loads(gzip.decompress(response.content))
+
+    def test_snapshot_then_delta(self):
+        route = self.add_routes(1, steps=2, fares=3)[0]
+        snapshot = self.bundle()
+        self.assertEqual({row[0] for row in snapshot["places"]}, {self.destination.pk, self.start.pk, self.other_start.pk})
+        self.assertEqual([row[0] for row in snapshot["routes"]], [route.pk])
+        self.assertEqual(len(snapshot["routes"][0][-1]), 2)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"/api/v1/cities/{self.city.pk}/bundle/", HTTP_IF_NONE_MATCH=f'"bundle-{self.city.pk}-full-{snapshot["version"]}"'
+            )
+        self.assertEqual(response.status_code, 304)
+
+        # only changes from here on: step the version clear of the delta overlap
+        with self.settings(BUNDLE_DELTA_OVERLAP=0):
+            PlaceAlias.objects.create(place=self.start, name="Kubwa Village")
+            route_id = route.pk
+            route.delete()
+            delta = self.bundle(since=snapshot["version"])
+        self.assertGreater(delta["version"], snapshot["version"])
+        self.assertEqual(delta["places"], [[self.start.pk, "Kubwa", "", ["Kubwa Village"]]])
+        self.assertEqual(delta["routes"], [])
+        self.assertEqual(delta["deleted"], {"places": [], "routes": [route_id]})
+
+    def test_only_issued_versions_get_stored_deltas(self):
+        snapshot = self.bundle()
+        version = snapshot["version"]
+        # up to date (or ahead): an empty delta straight away, and nothing stored for it
+        for since in (version, version + 10**9):
+            with self.assertNumQueries(1):
+                delta = self.bundle(since=since)
+            self.assertEqual((delta["since"], delta["places"], delta["routes"]), (since, [], []))
+            self.assertIsNone(cache.get(f"bundle:{self.city.pk}-{since}-{version}.json.gz"))
+
+        # a version this server never handed out gets the whole city, not a bundle of its own
+        response = self.client.get(f"/api/v1/cities/{self.city.pk}/bundle/", {"since": version - 1})
+        self.assertEqual(response["ETag"], f'"bundle-{self.city.pk}-full-{version}"')
+        self.assertEqual(json.loads(response.content), snapshot)
+        self.assertIsNone(cache.get(f"bundle:{self.city.pk}-{version - 1}-{version}.json.gz"))
+
+
+class PaginationTests(RouteTestCase):
+    def cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def test_pages_follow_the_cursor(self):
+        user = User.objects.create_user("rider")
+        for destination in ("Wuse Market", "Garki", "Kubwa"):
+            RouteSubmission.objects.create(city=self.city, destination=destination, submitted_by=user)
+        url, seen = "/api/v1/submissions/?limit=2", []
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(row["destination"] for row in page["results"])
+            url = page["next"]
+        # newest first, each once
+        self.assertEqual(seen, ["Kubwa", "Garki", "Wuse Market"])
+
+    def test_bad_cursors_are_not_found(self):
+        search = {"q": "wuse", "city": "Abuja, NG"}
+        for url, params, position in [
+            ("/api/v1/search/destinations/", search, ["x", "y"]),
+            ("/api/v1/search/destinations/", search, [None, None]),
+            ("/api/v1/submissions/", {}, ["notadate", "x"]),
+            ("/api/v1/submissions/", {}, [1]),
+        ]:
+            with self.subTest(url=url, position=position):
+                response = self.client.get(url, {**params, "cursor": self.cursor(position)})
+                self.assertEqual((response.status_code, response.json()["detail"]), (404, "Invalid cursor"))
+        self.assertEqual(self.client.get("/api/v1/submissions/", {"cursor": "%%%"}).status_code, 404)
+
+
+class FareSketchTests(SimpleTestCase):
+    DAY = 86400
+
+    def sketch(self, *amounts, timestamp=0.0):
+        sketch = FareSketch(half_life=30 * self.DAY)
+        for amount in amounts:
+            sketch.add(amount, timestamp)
+        return sketch
+
+    def test_quantiles_give_reported_amounts_back(self):
+        self.assertEqual(self.sketch(200, 250, 300).quantiles((20, 80)), [200, 300])
+        # amounts sharing a bucket read as their mean
+        self.assertEqual(self.sketch(200, 202).quantiles((50,)), [201])
+        self.assertEqual(self.sketch(0, 0, 100).quantiles((20,)), [0])
+        self.assertIsNone(self.sketch().quantiles((20, 80)))
+
+    def test_remove_takes_a_report_back_out(self):
+        sketch = self.sketch(200, 250, 300, 1000)
+        sketch.remove(1000, 0.0)
+        self.assertEqual((sketch.count, sketch.quantiles((20, 80))), (3, [200, 300]))
+        self.assertEqual(sketch.to_bytes(), self.sketch(200, 250, 300).to_bytes())
+
+    def test_older_reports_count_for_less(self):
+        sketch = self.sketch(200, 200, 200)
+        for _ in range(2):
+            sketch.add(500, 90 * self.DAY)  # three half-lives later each weighs 8 old ones
+        self.assertEqual(sketch.quantiles((20, 80)), [500, 500])
+        # the landmark moves once weights get large; quantiles and removal still hold
+        sketch.add(300, 61 * 30 * self.DAY)
+        self.assertEqual(sketch.landmark, 61 * 30 * self.DAY)
+        sketch.remove(300, 61 * 30 * self.DAY)
+        self.assertEqual(sketch.quantiles((50,)), [500])
+
+    def test_serialization_round_trips(self):
+        sketch = self.sketch(200, 250, 300, timestamp=5 * self.DAY)
+        sketch.remove(250, 5 * self.DAY)
+        loaded = FareSketch.from_bytes(sketch.to_bytes(), sketch.half_life)
+        self.assertEqual((loaded.landmark, loaded.count, loaded.weights, loaded.sums),
+                         (sketch.landmark, sketch.count, sketch.weights, sketch.sums))
+        self.assertEqual(FareSketch.from_bytes(b"", sketch.half_life).count, 0)
+        with self.assertRaises(ValueError):
+            FareSketch.from_bytes(b"\x09" + sketch.to_bytes()[1:], sketch.half_life)
+
+
+class SubmissionWorkflowTests(RouteTestCase):
+    """Submitting, queueing and approving route submissions."""
+
+    def submission(self, destination, steps=3, mode=RouteStep.BUS, drop_names=True, **fields):
+        submission = RouteSubmission.objects.create(city=self.city, destination=destination, **fields)
+        for order in range(1, steps + 1):
+            RouteStepSubmission.objects.create(
+                route_submission=submission, order=order, mode=mode, instruction="Board",
+                drop_name=f"Stop {order}" if drop_names else "",
+            )
+        return submission
+
+    def test_bulk_approve_reports_each_item(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        chosen = self.submission("Wuse", starting_point=self.start)
+        named = self.submission("wuse market", mode=RouteStep.KEKE, starting_point_text="Garki")
+        empty = self.submission("Wuse Market", steps=0)
+        done = self.submission("Wuse Market", status=RouteSubmission.APPROVED)
+
+        response = self.client.post("/api/v1/submissions/approve/", {"submissions": [
+            {"id": chosen.pk, "place_id": self.destination.pk},
+            {"id": named.pk},
+            {"id": empty.pk},
+            {"id": done.pk},
+            {"id": 999999},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([set(result) for result in results], [{"id", "route_id"}] * 2 + [{"id", "error"}] * 3)
+
+        routes = Route.objects.filter(pk__in=[result["route_id"] for result in results[:2]])
+        self.assertEqual({route.destination_id for route in routes}, {self.destination.pk})
+        self.assertEqual(RouteStep.objects.filter(route__in=routes).count(), 6)
+        self.assertEqual(set(routes.values_list("starting_places", flat=True)), {self.start.pk, self.other_start.pk})
+        self.assertEqual(RouteSubmission.objects.filter(status=RouteSubmission.APPROVED, approved_route__isnull=False).count(), 2)
+        # the counts the Route signals keep are maintained for bulk-created routes too
+        self.destination.refresh_from_db()
+        self.assertEqual(self.destination.route_count, 2)
+        self.assertEqual(PlaceConnection.objects.filter(destination=self.destination).count(), 2)
+
+    def test_bulk_approve_queries_do_not_grow_with_the_batch(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        url = "/api/v1/submissions/approve/"
+
+        def batch(name, size):
+            # new destinations and starting places to create, one route and one link each
+            submissions = [
+                self.submission(f"{name} {i}", starting_point_text=f"{name} Junction {i}") for i in range(size)
+            ]
+            return {"submissions": [{"id": submission.pk} for submission in submissions]}
+
+        self.client.post(url, batch("Jabi", 1), format="json")  # warms the city's dictionary
+        one = batch("Utako", 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, one, format="json")
+        ten = batch("Lugbe", 10)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.post(url, ten, format="json")
+        self.assertEqual([set(result) for result in response.json()["results"]], [{"id", "route_id"}] * 10)
+        self.assertEqual(PlaceConnection.objects.filter(route_count=1).count(), 12)
+
+    def test_bulk_approve_isolates_a_failing_item(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        good = self.submission("Wuse Market")
+        bad = self.submission("Garki", drop_names=False)
+        create_routes = moderation.create_routes
+
+        def failing(approvals, *args):
+            if any(submission.pk == bad.pk for submission, _ in approvals):
+                raise IntegrityError("broken row")
+            return create_routes(approvals, *args)
+
+        with mock.patch("app.moderation.create_routes", failing):
+            response = self.client.post("/api/v1/submissions/approve/", {"submissions": [{"id": good.pk}, {"id": bad.pk}]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        good_result, bad_result = response.json()["results"]
+        self.assertIn("route_id", good_result)
+        self.assertEqual(bad_result, {"id": bad.pk, "error": "broken row"})
+        self.assertEqual(list(RouteSubmission.objects.filter(status=RouteSubmission.APPROVED).values_list("id", flat=True)), [good.pk])
+
+        too_long = {"submissions": [{"id": bad.pk, "create_place": {"canonical_name": "x" * 201}}]}
+        self.assertEqual(self.client.post("/api/v1/submissions/approve/", too_long, format="json").status_code, 400)
+
+    def test_same_itinerary_merges_into_existing_route(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        first = self.submission("Wuse Market", starting_point=self.start)
+        again = self.submission("wuse mkt", starting_point=self.other_start)
+
+        for submission in (first, again):
+            self.client.post(f"/api/v1/submissions/{submission.pk}/approve/", {}, format="json")
+            process_jobs()
+        route = Route.objects.get()
+        self.assertEqual(route.steps.count(), 3)
+        self.assertEqual(set(route.starting_places.values_list("id", flat=True)), {self.start.pk, self.other_start.pk})
+        self.assertEqual(set(route.originating_submissions.values_list("id", flat=True)), {first.pk, again.pk})
+
+    def test_itineraries_naming_no_stops_are_not_merged(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        submissions = [self.submission("Wuse Market", drop_names=False, starting_point=self.start) for _ in range(3)]
+        self.client.post(f"/api/v1/submissions/{submissions[0].pk}/approve/", {}, format="json")
+        process_jobs()
+        # the other two in one batch
+        response = self.client.post("/api/v1/submissions/approve/", {"submissions": [
+            {"id": submission.pk} for submission in submissions[1:]
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Route.objects.filter(fingerprint="").count(), 3)
+        self.assertEqual(RouteStep.objects.count(), 9)
+
+    def test_moderation_queue(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        user = User.objects.create_user("rider")
+        pending = [self.submission("Wuse Market", submitted_by=user) for _ in range(5)]
+        self.submission("Wuse Market", status=RouteSubmission.REJECTED, reviewed_by=user)
+
+        get_city_id(self.city.pk)  # the per-worker city map is warm in a running server
+        # one query for the page with its users and city, one for all of its steps
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/v1/submissions/queue/", {"city": "abuja ng", "limit": 3})
+        page = response.json()
+        self.assertEqual([row["id"] for row in page["results"]], [submission.pk for submission in pending[:3]])
+        self.assertEqual(page["results"][0]["submitted_by"], "rider")
+        self.assertEqual(len(page["results"][0]["steps"]), 3)
+        self.assertIsNotNone(page["next"])
+
+
+    def test_approve_is_queued_once(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        submission = self.submission("Wuse Market", starting_point=self.start)
+        url = f"/api/v1/submissions/{submission.pk}/approve/"
+
+        response = self.client.post(url, {}, format="json", HTTP_IDEMPOTENCY_KEY="approve-1")
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        # a double click before the worker runs, and a retry after it did
+        self.assertEqual(self.client.post(url, {}, format="json").json()["id"], job_id)
+        self.assertEqual(len(process_jobs()), 1)
+        retry = self.client.post(url, {}, format="json", HTTP_IDEMPOTENCY_KEY="approve-1")
+        self.assertEqual((retry.status_code, retry.json()["id"]), (202, job_id))
+        self.assertEqual(self.client.post(url, {}, format="json").status_code, 400)
+
+        job = self.client.get(f"/api/v1/submissions/jobs/{job_id}/").json()
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["route"], Route.objects.get().pk)
+
+    def test_failed_approval_jobs_can_be_retried(self):
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        submission = self.submission("Wuse Market", starting_point=self.start)
+        url = f"/api/v1/submissions/{submission.pk}/approve/"
+        job_id = self.client.post(url, {}, format="json", HTTP_IDEMPOTENCY_KEY="approve-2").json()["id"]
+
+        # a deadlock goes back in the queue until the attempts run out
+        with self.settings(APPROVAL_JOB_MAX_ATTEMPTS=2), mock.patch("app.jobs.bulk_approve", side_effect=OperationalError("deadlock detected")):
+            self.assertEqual(process_jobs()[0].status, ApprovalJob.QUEUED)
+            self.assertEqual(process_jobs()[0].status, ApprovalJob.FAILED)
+        self.assertEqual(process_jobs(), [])
+
+        # the admin's retry with the same key queues the failed job again
+        retry = self.client.post(url, {}, format="json", HTTP_IDEMPOTENCY_KEY="approve-2")
+        self.assertEqual((retry.json()["id"], retry.json()["status"]), (job_id, ApprovalJob.QUEUED))
+        self.assertEqual(process_jobs()[0].status, ApprovalJob.DONE)
+
+    def test_place_names_need_letters_or_digits(self):
+        payload = {
+            "city": self.city.pk,
+            "destination": "Wuse Market",
+            "steps": [{"order": 1, "mode": RouteStep.BUS, "instruction": "Board at Kubwa"}],
+        }
+        self.client.force_authenticate(User.objects.create_user("rider"))
+        for field, value in (("destination", "!!!"), ("starting_point_text", "???")):
+            response = self.client.post("/api/v1/submissions/submit-route", {**payload, field: value}, format="json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.json())
+        self.assertFalse(RouteSubmission.objects.exists())
+
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        submission = self.submission("Wuse Market", starting_point=self.start)
+        url = f"/api/v1/submissions/{submission.pk}/approve/"
+        self.assertEqual(self.client.post(url, {"create_place": {"canonical_name": "..."}}, format="json").status_code, 400)
+
+    def test_one_failing_job_does_not_fail_its_batch(self):
+        reviewer = User.objects.create_user("admin", is_staff=True)
+        good = self.submission("Wuse Market", starting_point=self.start)
+        bad = self.submission("Wuse Market", starting_point=self.other_start)
+        for submission in (good, bad):
+            enqueue_approval(submission.pk, {}, reviewer=reviewer)
+        real_bulk_approve = moderation.bulk_approve
+
+        def bulk_approve(items, reviewer=None):
+            if any(item["id"] == bad.pk for item in items):
+                raise ValueError("bad payload")
+            return real_bulk_approve(items, reviewer=reviewer)
+
+        with mock.patch("app.jobs.bulk_approve", side_effect=bulk_approve):
+            jobs = {job.submission_id: job for job in process_jobs()}
+        self.assertEqual(jobs[good.pk].status, ApprovalJob.DONE)
+        self.assertIsNotNone(jobs[good.pk].route_id)
+        self.assertEqual((jobs[bad.pk].status, jobs[bad.pk].error), (ApprovalJob.FAILED, "bad payload"))
+
+    def test_abandoned_jobs_use_up_an_attempt(self):
+        stale = timezone.now() - timedelta(hours=1)
+        jobs = [
+            ApprovalJob.objects.create(
+                submission=self.submission("Wuse Market", starting_point=start),
+                payload={}, status=ApprovalJob.RUNNING, started_at=stale, attempts=attempts,
+            )
+            for start, attempts in ((self.start, 0), (self.other_start, 1))
+        ]
+        with self.settings(APPROVAL_JOB_MAX_ATTEMPTS=2):
+            claimed = claim_jobs(10)
+        self.assertEqual([job.pk for job in claimed], [jobs[0].pk])
+        self.assertEqual(claimed[0].attempts, 1)
+        jobs[1].refresh_from_db()
+        self.assertEqual((jobs[1].status, jobs[1].attempts), (ApprovalJob.FAILED, 2))
+
+    def test_submit_route_retries_are_replayed(self):
+        payload = {
+            "city": self.city.pk,
+            "destination": "Wuse Market",
+            "starting_point": self.start.pk,
+            "steps": [{"order": 1, "mode": RouteStep.BUS, "instruction": "Board at Kubwa"}],
+        }
+        url = "/api/v1/submissions/submit-route"
+        self.client.force_authenticate(User.objects.create_user("rider"))
+        first = self.client.post(url, payload, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.assertEqual(first.status_code, 201)
+
+        # the response is stored with the submission, so a retry reaching another worker gets it too
+        with self.settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other-worker"}}):
+            retry = self.client.post(url, payload, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(RouteStepSubmission.objects.count(), 1)
+
+        changed = self.client.post(url, {**payload, "destination": "Garki"}, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.assertEqual(changed.status_code, 422)
+        self.assertEqual(RouteSubmission.objects.count(), 1)
+
+        # a failed request leaves its key free for the retry
+        invalid = {**payload, "destination": ""}
+        self.assertEqual(self.client.post(url, invalid, format="json", HTTP_IDEMPOTENCY_KEY="retry-2").status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exclude(status_code=201).exists())
+
+    def test_idempotency_keys_are_claimed_until_they_expire(self):
+        payload = {
+            "city": self.city.pk,
+            "destination": "Wuse Market",
+            "starting_point": self.start.pk,
+            "steps": [{"order": 1, "mode": RouteStep.BUS, "instruction": "Board at Kubwa"}],
+        }
+        url = "/api/v1/submissions/submit-route"
+        self.client.force_authenticate(User.objects.create_user("rider"))
+        self.client.post(url, payload, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        record = IdempotencyKey.objects.get()
+
+        # the first request is still running on another worker
+        IdempotencyKey.objects.update(status_code=None, response=None)
+        self.assertEqual(self.client.post(url, payload, format="json", HTTP_IDEMPOTENCY_KEY="retry-1").status_code, 409)
+
+        # its worker died: once the claim expires the retry runs for real
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        retry = self.client.post(url, payload, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", retry)
+        self.assertEqual(RouteSubmission.objects.count(), 2)
+        self.assertNotEqual(IdempotencyKey.objects.get().pk, record.pk)
+
+
+class PlaceNormalizationMigrationTests(TransactionTestCase):
+    before = [("app", "0005_place_search_indexes")]
+    after = [("app", "0007_place_normalized_constraints")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_aliases_are_unique_per_place(self):
+        city = City.objects.create(name="Abuja, NG")
+        kubwa = Place.objects.create(city=city, canonical_name="Kubwa")
+        garki = Place.objects.create(city=city, canonical_name="Garki")
+        PlaceAlias.objects.create(place=kubwa, name="Old Market")
+        PlaceAlias.objects.create(place=garki, name="Old Market")
+        with self.assertRaises(IntegrityError):
+            PlaceAlias.objects.create(place=kubwa, name="old  market")
+
+    def test_backfill_merges_spellings_and_reverses(self):
+        apps = self.migrate(self.before)
+        City, Place, PlaceAlias, Route = (apps.get_model("app", name) for name in ("City", "Place", "PlaceAlias", "Route"))
+        city = City.objects.create(name="Abuja, NG")
+        wuse = Place.objects.create(city=city, canonical_name="Wuse Market")
+        duplicate = Place.objects.create(city=city, canonical_name="wuse  market")
+        kubwa = Place.objects.create(city=city, canonical_name="Kubwa")
+        garki = Place.objects.create(city=city, canonical_name="Garki")
+        route = Route.objects.create(destination=duplicate)
+        route.starting_places.add(kubwa)
+        PlaceAlias.objects.create(place=kubwa, name="Old Market")
+        PlaceAlias.objects.create(place=kubwa, name="old market")
+        PlaceAlias.objects.create(place=garki, name="Old Market")
+
+        apps = self.migrate(self.after)
+        Place, PlaceAlias, Route = (apps.get_model("app", name) for name in ("Place", "PlaceAlias", "Route"))
+        self.assertFalse(Place.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(Route.objects.get(pk=route.pk).destination_id, wuse.pk)
+        # the merged spelling stays an alias; places keep sharing "Old Market", one spelling each
+        aliases = sorted(PlaceAlias.objects.values_list("place_id", "name"))
+        self.assertEqual(aliases, sorted([(wuse.pk, "wuse  market"), (kubwa.pk, "Old Market"), (garki.pk, "Old Market")]))
+
+        apps = self.migrate(self.before)
+        Place, PlaceAlias = apps.get_model("app", "Place"), apps.get_model("app", "PlaceAlias")
+        self.assertTrue(Place.objects.filter(city_id=city.pk, canonical_name="wuse  market").exists())
+        self.assertFalse(PlaceAlias.objects.filter(place_id=wuse.pk).exists())
@@ -8,6 +8,12 @@ urlpatterns = [
         RouteSubmissionViewSet.as_view({"get": "list"}),
         name="route-submission-list",
     ),
+    path(
+        "submissions/queue/",
+        RouteSubmissionViewSet.as_view({"get": "queue"}),
+        name="route-submission-queue",
+    ),
+    path("submissions/jobs/<int:pk>/", ApprovalJobView.as_view(), name="approval-job-detail"),
     path(
         "submissions/<int:pk>/",
         RouteSubmissionViewSet.as_view({"get": "retrieve"}),
@@ -20,6 +26,11 @@ urlpatterns = [
         RouteSubmissionViewSet.as_view({"post": "approve"}),
         name="route-submission-approve",
     ),
+    path(
+        "submissions/approve/",
+        RouteSubmissionViewSet.as_view({"post": "bulk_approve"}),
+        name="route-submission-bulk-approve",
+    ),
     path(
         "submissions/<int:pk>/reject/",
         RouteSubmissionViewSet.as_view({"post": "reject"}),
@@ -28,8 +39,13 @@ urlpatterns = [
     path("routes/<int:pk>/", RouteView.as_view(), name="route-detail"),
     path("route-steps/<step_id>/fares/", StepFareView.as_view(), name="stepfare-detail"),
     path("search/destinations/",DestinationSearchView.as_view(), name="search-destinations"),
+    path("search/autocomplete/", PlaceAutocompleteView.as_view(), name="search-autocomplete"),
+    path("search/cache-stats/", SearchCacheStatsView.as_view(), name="search-cache-stats"),
     path("search/destinations/<int:destination_id>/starting-places/",StartingPlaceSearchView.as_view(),name="search-starting-places"),
     path("routes/lookup/",RouteLookupView.as_view(),name="route-lookup"),
+    path("routes/lookup/batch/", BatchRouteLookupView.as_view(), name="route-lookup-batch"),
+    path("routes/plan/", RoutePlanView.as_view(), name="route-plan"),
+    path("cities/<str:city>/bundle/", CityBundleView.as_view(), name="city-bundle"),
     path("submissions/submit-route", SubmitRouteView.as_view(), name="submit-route"),
     path("submissions/<int:pk>/edit", EditSubmissionView.as_view(), name="edit-submission"),
 
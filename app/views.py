@@ -1,10 +1,29 @@
+import gzip
+import hashlib
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import viewsets, status, decorators, permissions, generics
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
-from .models import Route, RouteStep, RouteSubmission, Place, PlaceAlias
+from .models import ApprovalJob, IdempotencyKey, Route, RouteStep, RouteSubmission, Place
+from . import bundles, jobs, moderation, planner
+from .cities import get_city_id
+from .route_cache import route_documents, route_etag, with_route_details
+from .names import query_variants
+from .search import get_search_backend, rank_matches
+from .search_cache import SearchCache, place_city_id, search_cache_stats
 from .serializers import *
 # Create your views here.
 
@@ -31,7 +50,7 @@ def reject_submission(submission_id, reviewer=None, admin_notes=""):
 
 class IsStaffOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
-        if view.action in ("approve", "reject"):
+        if view.action in ("approve", "reject", "bulk_approve", "queue"):
             return request.user and request.user.is_staff
         return True
 class IsAdmin(permissions.BasePermission):
@@ -40,71 +59,72 @@ class IsAdmin(permissions.BasePermission):
 
 class RouteSubmissionViewSet(viewsets.ReadOnlyModelViewSet):
     """
-    Read-only list/retrieve of submissions.
-    Admin-only actions:
-      - POST /submissions/{pk}/approve/  { "place_id": 123 }
+    Read-only list/retrieve of submissions, newest first; the list takes ?status= and ?city=.
+    Admin-only:
+      - GET  /submissions/queue/?city=   pending submissions, oldest first
+      - POST /submissions/{pk}/approve/  { "place_id": 123 }  -> 202, queued (GET /submissions/jobs/{id}/)
       - POST /submissions/{pk}/reject/   { "admin_notes": "reason" }
+      - POST /submissions/approve/       { "submissions": [{"id": 1, "place_id": 123}, {"id": 2}, ...] }
     """
-    queryset = RouteSubmission.objects.all().order_by("-created_at")
+    # users and city joined, steps in one more query: a page costs two queries
+    queryset = RouteSubmission.objects.select_related("submitted_by", "reviewed_by", "city").prefetch_related("steps")
     serializer_class = RouteSubmissionSerializer
+    ordering = ("-created_at", "-id")
     permission_classes = [IsStaffOrReadOnly]
     throttle_classes = [UserRateThrottle]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "queue":
+            # served from the partial app_submission_queue_idx
+            queryset = queryset.filter(status=RouteSubmission.SUBMITTED)
+        elif self.action == "list" and "status" in self.request.query_params:
+            queryset = queryset.filter(status=self.request.query_params["status"])
+        if self.action in ("list", "queue") and "city" in self.request.query_params:
+            city_id = get_city_id(self.request.query_params["city"])
+            queryset = queryset.filter(city_id=city_id) if city_id is not None else queryset.none()
+        return queryset
+
+    @decorators.action(detail=False, methods=["get"], url_path="queue")
+    def queue(self, request):
+        self.ordering = ("created_at", "id")
+        return self.list(request)
+
     @decorators.action(detail=True, methods=["post"], url_path="approve")
     def approve(self, request, pk=None):
-        with transaction.atomic():
-            # fetch & lock candidate row early
-            submission = get_object_or_404(RouteSubmission.objects.select_for_update(), pk=pk)
-            if submission.status != RouteSubmission.SUBMITTED:
-                return Response({"detail": "Submission not in submitted state"}, status=status.HTTP_400_BAD_REQUEST)
-
-            serializer = ApproveSubmissionSerializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            validated = serializer.validated_data
-
-            place = None
-
-            # 1) explicit place_id chosen by admin
-            place_id = validated.get("place_id")
-            if place_id:
-                place = get_object_or_404(Place, pk=place_id)
-                if place.city_id != submission.city_id:
-                    return Response({"detail": "Place city does not match submission city"}, status=status.HTTP_400_BAD_REQUEST)
-
-            # 2) create_place requested by admin
-            elif validated.get("create_place"):
-                cp = validated["create_place"]
-                canonical = (cp.get("canonical_name") or submission.destination).strip()
-                area = cp.get("area", "")
-                place = Place.objects.filter(city=submission.city, canonical_name__iexact=canonical).first()
-                if not place:
-                    place = Place.objects.create(city=submission.city, canonical_name=canonical, area=area)
-
-            # 3) try auto-match by canonical_name or alias
-            else:
-                # try canonical name
-                place = Place.objects.filter(city=submission.city, canonical_name__iexact=submission.destination.strip()).first()
-                if not place:
-                    alias = PlaceAlias.objects.filter(place__city=submission.city, name__iexact=submission.destination.strip()).select_related("place").first()
-                    if alias:
-                        place = alias.place
-
-                # 4) if still not found -> auto-create using submission.destination
-                if not place:
-                    canonical = submission.destination.strip()
-                    # double-check to avoid race/duplicates (case-insensitive)
-                    place = Place.objects.filter(city=submission.city, canonical_name__iexact=canonical).first()
-                    if not place:
-                        place = Place.objects.create(city=submission.city, canonical_name=canonical)
-
-            # At this point we have a Place; approve inside a transaction with re-lock
-            
-            submission = RouteSubmission.objects.select_for_update().get(pk=submission.pk)
-            if submission.status != RouteSubmission.SUBMITTED:
-                return Response({"detail": "Submission not in submitted state"}, status=status.HTTP_400_BAD_REQUEST)
-            route = submission.approve(place=place, reviewer=(request.user if request.user.is_authenticated else None))
+        """
+        Queue the approval (app/jobs.py) and answer 202 with the job; a worker matches the
+        destination and creates the route. Send an Idempotency-Key header so a retried
+        request gets the same job back.
+        """
+        serializer = ApproveSubmissionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_object_or_404(RouteSubmission.objects.only("id"), pk=pk)
+        try:
+            job = jobs.enqueue_approval(
+                int(pk),
+                serializer.validated_data,
+                reviewer=(request.user if request.user.is_authenticated else None),
+                idempotency_key=request.headers.get("Idempotency-Key"),
+            )
+        except jobs.IdempotencyKeyReused as error:
+            return Response({"detail": str(error)}, status=status.HTTP_409_CONFLICT)
+        except ValueError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        response = Response(ApprovalJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        response["Location"] = reverse("approval-job-detail", args=[job.pk])
+        return response
 
-        return Response({"route_id": route.pk}, status=status.HTTP_201_CREATED)
+    @decorators.action(detail=False, methods=["post"], url_path="approve")
+    def bulk_approve(self, request):
+        """Approve up to 200 submissions in one transaction; each item reports its route_id or error."""
+        serializer = BulkApproveSubmissionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = moderation.bulk_approve(
+            serializer.validated_data["submissions"],
+            reviewer=(request.user if request.user.is_authenticated else None),
+        )
+        return Response({"results": results}, status=status.HTTP_200_OK)
 
     @decorators.action(detail=True, methods=["post"], url_path="reject")
     def reject(self, request, pk=None):
@@ -123,59 +143,264 @@ class RouteSubmissionViewSet(viewsets.ReadOnlyModelViewSet):
             submission.reject(reviewer=(request.user if request.user.is_authenticated else None), notes=notes)
 
         return Response({"detail": "rejected"}, status=status.HTTP_200_OK)
+class ApprovalJobView(generics.RetrieveAPIView):
+    """Status of a queued approval: queued, running, done (with its route) or failed (with the error)."""
+    queryset = ApprovalJob.objects.all()
+    serializer_class = ApprovalJobSerializer
+    permission_classes = [IsAdmin]
+
+
+def with_validators(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+def route_list_response(next_link, documents):
+    """The paginated response body assembled from pre-rendered route documents."""
+    body = b'{"next":%s,"results":[%s]}' % (json.dumps(next_link).encode(), b",".join(documents))
+    return HttpResponse(body, content_type="application/json")
+
+
 class RouteView(generics.RetrieveAPIView):
-    queryset = Route.objects.all()
+    """Served from the cached route document (app/route_cache.py); RouteSerializer runs only on a miss."""
+    queryset = with_route_details(Route.objects.all())
     serializer_class = RouteSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        route_id = self.kwargs["pk"]
+        # the only query when the client's copy is current
+        updated_at = Route.objects.filter(pk=route_id).values_list("updated_at", flat=True).first()
+        if updated_at is None:
+            raise NotFound()
+        etag = route_etag(route_id, updated_at)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(updated_at.timestamp())
+        )
+        if not_modified is not None:
+            return with_validators(not_modified, etag, updated_at)
+
+        document = route_documents({route_id: updated_at}).get(route_id)
+        if document is None:
+            raise NotFound()
+        return with_validators(HttpResponse(document, content_type="application/json"), etag, updated_at)
 class StepFareView(generics.ListCreateAPIView):
     serializer_class = StepFareSerializer
+    ordering = ("-created_at", "-id")
     def get_queryset(self):
         step_id = self.kwargs["step_id"]
         return StepFare.objects.filter(route_step_id=step_id)
-    
-from django.db.models import Q
-    
-class DestinationSearchView(generics.ListAPIView):
+
+    def perform_create(self, serializer):
+        step = get_object_or_404(RouteStep, pk=self.kwargs["step_id"])
+        # the step's FareEstimate is refreshed by the StepFare signal inside this transaction
+        with transaction.atomic():
+            serializer.save(route_step=step)
+
+
+class CachedSearchMixin:
+    """
+    Serves list() from a SearchCache keyed by the city and the normalized query, so
+    "Wuse 2" and "wuse ii" share an entry. Any Place/PlaceAlias/Route write in the city
+    bumps its generation, which retires every entry for it at once. The key is also the
+    ETag, so If-None-Match is answered from the city's generation counters alone.
+    """
+    search_cache = None
+
+    def get_search_city_id(self):
+        return get_city_id(self.request.query_params.get("city"))
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get("q", "").strip()
+        city_id = self.get_search_city_id()
+        if city_id is None:
+            return super().list(request, *args, **kwargs)
+
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in ("q", "city")
+            for value in values
+        )
+        parts = [sorted(query_variants(query)), params, sorted(kwargs.items())]
+        key = self.search_cache.key(city_id, parts)
+        etag = '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return with_validators(not_modified, etag)
+
+        data = self.search_cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            self.search_cache.set(key, data)
+        return with_validators(Response(data), etag)
+
+
+class ReadRowsMixin:
+    """
+    list() from .values() rows of `read_fields` instead of model instances through the
+    ModelSerializer. Only for flat serializers whose fields are plain columns; read_fields
+    must list them in the serializer's order so the JSON is unchanged.
+    """
+    read_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # the pagination key has to come along for the cursor
+        keys = [field.lstrip("-") for field in getattr(self, "ordering", None) or ()]
+        rows = queryset.values(*dict.fromkeys([*self.read_fields, *keys]))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(rows_data(rows, self.read_fields))
+        return self.get_paginated_response(rows_data(page, self.read_fields))
+
+
+class IdempotentCreateMixin:
+    """
+    Honors an Idempotency-Key header on create(): the first response for a key is stored
+    (IdempotencyKey) for IDEMPOTENCY_KEY_TTL seconds, in the same transaction as the write,
+    and a retry with the same key and body gets it back (Idempotent-Replayed: true) without
+    writing anything, whichever worker it reaches. Keys are scoped to the user and the view;
+    reusing one with a different body is a 422, and a retry arriving while the first
+    request is still running is a 409.
+    """
+    idempotency_scope = None
+    # how long a key stays claimed by a request that never finished (e.g. a killed worker)
+    idempotency_lock_timeout = 60
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if not key:
+            return super().create(request, *args, **kwargs)
+
+        user = request.user.pk if request.user.is_authenticated else "anon"
+        digest = hashlib.sha256(
+            ("%s:%s:%s" % (self.idempotency_scope or type(self).__name__, user, key)).encode()
+        ).hexdigest()
+        body = hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+        now = timezone.now()
+        # expired keys are free again, this one included
+        IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+        # committed on its own so retries on other workers see the claim while this one runs
+        record, claimed = IdempotencyKey.objects.get_or_create(
+            key=digest,
+            defaults={"request_hash": body, "expires_at": now + timedelta(seconds=self.idempotency_lock_timeout)},
+        )
+        if not claimed:
+            if record.request_hash != body:
+                return Response(
+                    {"detail": "Idempotency-Key was already used with a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is None:
+                return Response(
+                    {"detail": "A request with this Idempotency-Key is still in progress"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return Response(record.response, status=record.status_code, headers={"Idempotent-Replayed": "true"})
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+                # stored with the write, so a committed create always has its response
+                IdempotencyKey.objects.filter(pk=record.pk).update(
+                    status_code=response.status_code,
+                    response=response.data,
+                    expires_at=timezone.now() + timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400)),
+                )
+        except Exception:
+            # nothing was written: let the retry run for real
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            raise
+        return response
+
+
+class SearchCacheStatsView(generics.GenericAPIView):
+    """GET /search/cache-stats/ - hit/miss counters and write totals per cached search endpoint."""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(search_cache_stats())
+
+
+class DestinationSearchView(CachedSearchMixin, ReadRowsMixin, generics.ListAPIView):
     serializer_class = PlaceSearchSerializer
+    read_fields = PlaceSearchSerializer.Meta.fields
+    search_cache = SearchCache("destinations")
+    ordering = ("rank", "id")
 
     def get_queryset(self):
         query = self.request.query_params.get("q", "").strip()
 
+        if not query:
+            # still annotated: the read path selects the rank for the cursor
+            return rank_matches(Place.objects.none(), query)
+
+        city_id = get_city_id(self.request.query_params.get("city"))
+        if city_id is None:
+            raise NotFound("Unknown or inactive city")
+
+        places = get_search_backend().filter(Place.objects.filter(city_id=city_id), query, city_id)
+        return rank_matches(places, query)
+class PlaceAutocompleteView(CachedSearchMixin, ReadRowsMixin, generics.ListAPIView):
+    """
+    GET /search/autocomplete/?q=wu&city=Abuja, NG&limit=10
+    Top matches only: exact > prefix > substring > alias, then by number of routes.
+    """
+    serializer_class = PlaceAutocompleteSerializer
+    read_fields = PlaceAutocompleteSerializer.Meta.fields
+    search_cache = SearchCache("autocomplete")
+    # already capped by ?limit, one page only
+    pagination_class = None
+    default_limit = 10
+    max_limit = 20
+
+    def get_queryset(self):
+        query = self.request.query_params.get("q", "").strip()
         if not query:
             return Place.objects.none()
 
-        return (
-            Place.objects.filter(
-                city__name__iexact="Abuja, NG"
-            )
-            .filter(
-                Q(canonical_name__icontains=query) |
-                Q(aliases__name__icontains=query)
-            )
-            .distinct()
-        )
-class StartingPlaceSearchView(generics.ListAPIView):
+        city_id = get_city_id(self.request.query_params.get("city"))
+        if city_id is None:
+            raise NotFound("Unknown or inactive city")
+
+        try:
+            limit = int(self.request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = max(1, min(limit, self.max_limit))
+
+        places = get_search_backend().filter(Place.objects.filter(city_id=city_id), query, city_id)
+        return rank_matches(places, query).only("id", "canonical_name", "area")[:limit]
+class StartingPlaceSearchView(CachedSearchMixin, ReadRowsMixin, generics.ListAPIView):
     serializer_class = PlaceSearchSerializer
+    read_fields = PlaceSearchSerializer.Meta.fields
+    search_cache = SearchCache("starting-places")
+    ordering = ("-connection_count", "id")
+
+    def get_search_city_id(self):
+        return place_city_id(self.kwargs["destination_id"])
 
     def get_queryset(self):
         destination_id = self.kwargs["destination_id"]
         query = self.request.query_params.get("q", "").strip()
 
-        routes = Route.objects.filter(destination_id=destination_id)
-
+        # served from the PlaceConnection adjacency: one indexed lookup, no join through routes
         places = Place.objects.filter(
-            outgoing_routes__in=routes
-        )
+            outbound_connections__destination_id=destination_id,
+            outbound_connections__route_count__gt=0,
+        ).annotate(connection_count=F("outbound_connections__route_count"))
 
         if query:
-            places = places.filter(
-                Q(canonical_name__icontains=query) |
-                Q(aliases__name__icontains=query)
-            )
+            places = get_search_backend().filter(places, query)
 
-            return places.distinct()
+        return places
 class RouteLookupView(generics.ListAPIView):
     serializer_class = RouteSerializer
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    ordering = ("id",)
 
     def get_queryset(self):
         destination_id = self.request.query_params.get("destination")
@@ -184,15 +409,154 @@ class RouteLookupView(generics.ListAPIView):
         if not destination_id or not starting_place_id:
             return Route.objects.none()
 
-        return (
-            Route.objects.filter(
-                destination_id=destination_id,
-                starting_places__id=starting_place_id
-            )
-            .prefetch_related("steps", "starting_places")
+        return Route.objects.filter(
+            destination_id=destination_id,
+            starting_places__id=starting_place_id
+        ).only("id", "updated_at")
+
+    def list(self, request, *args, **kwargs):
+        # only ids and timestamps are queried here, the documents come from the route cache
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        next_link = self.paginator.get_next_link()
+        etag = '"%s"' % hashlib.sha1(
+            "|".join([str(next_link)] + [route_etag(route.pk, route.updated_at) for route in page]).encode()
+        ).hexdigest()
+        last_modified = max((route.updated_at for route in page), default=None)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified and int(last_modified.timestamp())
+        )
+        if not_modified is not None:
+            return with_validators(not_modified, etag, last_modified)
+
+        documents = route_documents({route.pk: route.updated_at for route in page})
+        response = route_list_response(
+            next_link,
+            [documents[route.pk] for route in page if route.pk in documents],
         )
+        return with_validators(response, etag, last_modified)
+
+class BatchRouteLookupView(generics.GenericAPIView):
+    """
+    POST /routes/lookup/batch/  {"pairs": [{"start": 1, "destination": 2}, ...]}  (up to 50 pairs)
+    Same routes as /routes/lookup/ for every pair, in request order, for one throttle hit.
+    All pairs are matched with one query on the starting-place links; documents of every
+    route found come from the route cache, with misses rendered together in one batch.
+    """
+    serializer_class = BatchRouteLookupSerializer
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pairs = [(pair["start"], pair["destination"]) for pair in serializer.validated_data["pairs"]]
+
+        links = Route.starting_places.through.objects.filter(
+            place_id__in={start for start, _ in pairs},
+            route__destination_id__in={destination for _, destination in pairs},
+        ).values_list("place_id", "route__destination_id", "route_id", "route__updated_at")
+        # the IN x IN filter can pair a start with another pair's destination: keep asked pairs only
+        wanted = set(pairs)
+        routes = defaultdict(list)
+        updated = {}
+        for start, destination, route_id, updated_at in links:
+            if (start, destination) in wanted:
+                routes[(start, destination)].append(route_id)
+                updated[route_id] = updated_at
+
+        documents = route_documents(updated)
+        results = [
+            b'{"start":%d,"destination":%d,"routes":[%s]}' % (
+                start,
+                destination,
+                b",".join(documents[route_id] for route_id in sorted(routes[(start, destination)]) if route_id in documents),
+            )
+            for start, destination in pairs
+        ]
+        return HttpResponse(b'{"results":[%s]}' % b",".join(results), content_type="application/json")
+
+
+class RoutePlanView(generics.GenericAPIView):
+    """
+    GET /routes/plan/?start=<place id>&destination=<place id>&max_hops=3
+    Composes multi-leg itineraries (A -> B on one route, B -> C on another) from this
+    worker's in-memory route graph of the city (app/planner.py). Each leg carries the
+    route's cached document, so a warm plan costs two queries: the city's graph generation and
+    the legs' updated_at.
+    """
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+
+    def get(self, request):
+        try:
+            start_id = int(request.query_params["start"])
+            destination_id = int(request.query_params["destination"])
+            max_hops = int(request.query_params.get("max_hops", planner.max_hops()))
+        except (KeyError, ValueError):
+            return Response({"detail": "start and destination place ids are required"}, status=status.HTTP_400_BAD_REQUEST)
+        if start_id == destination_id:
+            return Response({"detail": "start and destination are the same place"}, status=status.HTTP_400_BAD_REQUEST)
+        max_hops = max(1, min(max_hops, planner.max_hops()))
+
+        start_city, destination_city = place_city_id(start_id), place_city_id(destination_id)
+        if start_city is None or destination_city is None:
+            raise NotFound("Unknown place")
+        if start_city != destination_city:
+            return Response({"detail": "Places are in different cities"}, status=status.HTTP_400_BAD_REQUEST)
+
+        itineraries = planner.get_route_graph(start_city).plan(start_id, destination_id, max_hops)
+        documents = route_documents(route_id for _, legs in itineraries for _, _, route_id in legs)
+        parts = []
+        for cost, legs in itineraries:
+            if any(route_id not in documents for _, _, route_id in legs):
+                continue  # a route deleted since the graph was built
+            body = b",".join(
+                b'{"from":%d,"to":%d,"route":%s}' % (source, target, documents[route_id])
+                for source, target, route_id in legs
+            )
+            parts.append(b'{"cost":%d,"legs":[%s]}' % (round(cost), body))
+        return HttpResponse(b'{"itineraries":[%s]}' % b",".join(parts), content_type="application/json")
+
+
+class CityBundleView(generics.GenericAPIView):
+    """
+    GET /cities/<city>/bundle/             whole city for offline use
+    GET /cities/<city>/bundle/?since=<v>   only what changed since the client's version v
+    Gzipped JSON (app/bundles.py) built once per version of the city; the ETag is the
+    version, so an up-to-date client gets a 304 after a single query. A v this server
+    didn't recently hand out gets the whole city instead ("since": null).
+    """
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+
+    def get(self, request, city):
+        city_id = get_city_id(city)
+        version = bundles.bundle_version(city_id) if city_id is not None else None
+        if version is None:
+            raise NotFound("Unknown city")
+        since = request.query_params.get("since")
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"detail": "since must be a bundle version"}, status=status.HTTP_400_BAD_REQUEST)
+            since = bundles.delta_base(city_id, version, since)
+
+        etag = f'"bundle-{city_id}-{"full" if since is None else since}-{version}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        data = bundles.get_bundle(city_id, version, since)
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = HttpResponse(data, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(gzip.decompress(data), content_type="application/json")
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return with_validators(response, etag)
+
 
-class SubmitRouteView(generics.CreateAPIView):
+class SubmitRouteView(IdempotentCreateMixin, generics.CreateAPIView):
+    """Mobile clients send an Idempotency-Key so a retried submission is only stored once."""
+    idempotency_scope = "submit-route"
     serializer_class = RouteSubmissionCreateSerializer
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -141,6 +141,9 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # keyset pagination: views set `ordering` to a unique key, see app/pagination.py
+    'DEFAULT_PAGINATION_CLASS': 'app.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.AnonRateThrottle',
         'rest_framework.throttling.UserRateThrottle'
@@ -151,11 +154,49 @@ REST_FRAMEWORK = {
     }
    
 }
+# Render API responses with orjson (app/renderers.py; same bytes, falls back to the stdlib
+# encoder when orjson isn't installed)
+FAST_JSON_RENDERER = env.bool('FAST_JSON_RENDERER', default=False)
+if FAST_JSON_RENDERER:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        'app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ]
+# City used by search endpoints when the request doesn't pass ?city=<name or id>
+DEFAULT_CITY = 'Abuja, NG'
+# Place search backend, see app/search.py. DatabaseSearchBackend uses pg_trgm/tsvector on
+# Postgres and an FTS5 table on SQLite; MemorySearchBackend answers from a per-worker index.
+PLACE_SEARCH_BACKEND = env('PLACE_SEARCH_BACKEND', default='app.search.DatabaseSearchBackend')
+# Minimum similarity (0-1) for free-text place names to be matched to an existing Place, see app/matching.py
+PLACE_MATCH_THRESHOLD = 0.85
+# Fare estimates (app/fares.py): band reported for a step, and how fast old reports fade out
+FARE_ESTIMATE_PERCENTILES = (20, 80)
+FARE_HALF_LIFE_DAYS = 30
+# Most legs the route planner (/routes/plan/) will chain together
+PLANNER_MAX_HOPS = 3
+# Search results and the per-city search generations live here; point CACHE_URL at a shared
+# cache (e.g. redis://...) when running more than one worker so invalidation reaches all of them
 CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+    "default": env.cache_url('CACHE_URL', default='locmemcache://'),
 }
+# Seconds a cached search result may be served; writes invalidate it sooner
+SEARCH_CACHE_TIMEOUT = env.int('SEARCH_CACHE_TIMEOUT', default=600)
+# Seconds a rendered route document is kept (app/route_cache.py); changed routes get new keys
+ROUTE_DOCUMENT_TIMEOUT = env.int('ROUTE_DOCUMENT_TIMEOUT', default=86400)
+# Offline city bundles (app/bundles.py): kept in this directory when set, otherwise in the cache
+BUNDLE_DIR = env('BUNDLE_DIR', default=None)
+# Seconds a cached bundle is kept when BUNDLE_DIR is not set
+BUNDLE_TIMEOUT = env.int('BUNDLE_TIMEOUT', default=86400)
+# Seconds a delta reaches back before the client's version, for slow transactions committing late
+BUNDLE_DELTA_OVERLAP = env.int('BUNDLE_DELTA_OVERLAP', default=60)
+# How many of a city's latest bundle versions clients can ask for a delta from; older ones get the full bundle
+BUNDLE_DELTA_VERSIONS = env.int('BUNDLE_DELTA_VERSIONS', default=20)
+# Seconds before a running approval job whose worker died is claimed again (app/jobs.py)
+APPROVAL_JOB_TIMEOUT = env.int('APPROVAL_JOB_TIMEOUT', default=300)
+# Tries an approval job gets when the database errors out (deadlock, lock timeout) before it fails
+APPROVAL_JOB_MAX_ATTEMPTS = env.int('APPROVAL_JOB_MAX_ATTEMPTS', default=5)
+# Seconds a response is replayed for retries carrying the same Idempotency-Key (route submissions)
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=86400)
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases